@@ -0,0 +1,199 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  agreement.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+agreement_copyright = 'agreement.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# agreement between two cluster images of the same grid. the label
+# confusion matrix is counted in one bincount pass over chunks of pixels
+# (optionally transcribing the second image through a LUT on the way) and
+# every score is computed from the (nlabels,nlabels) matrix:
+#
+#    count, pcent           pixels labelled differently
+#    class_disagreement     per class of the first image, the fraction of
+#                           its pixels the second image labels differently
+#    ari                    adjusted Rand index
+#    nmi                    normalized mutual information (arithmetic mean
+#                           normalization)
+#
+# ari and nmi do not depend on how the classes are numbered, so they also
+# measure agreement independent of the LUT.
+
+import sys
+import numpy as np
+
+chunk_pixels = 1 << 22           # pixels counted per bincount pass
+
+# ----------------------------------------------------------------------------
+
+# (nlabels,nlabels) confusion matrix, conf[a,b] = number of pixels with
+# labels1 == a and lut2[labels2] == b (labels2 itself if lut2 is None)
+def confusion( labels1, labels2, nlabels, lut2=None, chunk=None ):
+
+    if chunk is None:
+        chunk = chunk_pixels
+
+    labels1 = np.asarray( labels1 ).reshape( -1 )
+    labels2 = np.asarray( labels2 ).reshape( -1 )
+    if labels1.size != labels2.size:
+        print( 'agreement: images have', labels1.size, 'and', labels2.size,
+               'pixels...exiting', file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    if lut2 is not None:
+        lut2 = np.asarray( lut2 ).astype( np.int64 )
+
+    conf = np.zeros( nlabels*nlabels, dtype=np.int64 )
+    for k in range( 0, labels1.size, chunk ):
+        a = labels1[k:k+chunk].astype( np.int64 )
+        b = labels2[k:k+chunk]
+        b = lut2[b] if lut2 is not None else b.astype( np.int64 )
+
+        if a.max() >= nlabels or b.max() >= nlabels or a.min() < 0 or b.min() < 0:
+            print( 'agreement: label value out of range 0 -', nlabels-1,
+                   '...exiting', file=sys.stderr, flush=True )
+            sys.exit( 2 )
+
+        a *= nlabels
+        a += b
+        conf += np.bincount( a, minlength=nlabels*nlabels )
+
+    return conf.reshape( nlabels, nlabels )
+
+# number of pairs of n things
+def pairs( n ):
+
+    n = np.asarray( n, dtype=np.float64 )
+    return n*(n-1)/2
+
+def adjusted_rand( conf ):
+
+    npix = conf.sum()
+    index = pairs( conf ).sum()
+    rows = pairs( conf.sum( axis=1 ) ).sum()
+    cols = pairs( conf.sum( axis=0 ) ).sum()
+
+    expected = rows*cols/pairs( npix )
+    best = (rows + cols)/2
+    if best == expected:
+        return 1.0
+
+    return float( (index - expected)/(best - expected) )
+
+def entropy( counts ):
+
+    p = counts[ counts > 0 ]/counts.sum()
+    return float( -np.sum( p*np.log( p ) ) )
+
+def normalized_mutual_info( conf ):
+
+    npix = conf.sum()
+    rows = conf.sum( axis=1 )
+    cols = conf.sum( axis=0 )
+
+    a, b = np.nonzero( conf )
+    p = conf[a,b]/npix
+    mutual = float( np.sum( p*np.log( conf[a,b]*npix/( rows[a]*cols[b].astype( np.float64 ) ) ) ) )
+
+    h1 = entropy( rows )
+    h2 = entropy( cols )
+    if h1 + h2 == 0.0:
+        return 1.0
+
+    return max( 0.0, mutual/((h1 + h2)/2) )
+
+# all scores of a confusion matrix as a dict
+def scores( conf ):
+
+    npix = int( conf.sum() )
+    same = np.diag( conf )
+    count = npix - int( same.sum() )
+
+    sizes = conf.sum( axis=1 )
+    class_disagreement = np.zeros( len( conf ) )
+    np.divide( sizes - same, sizes, out=class_disagreement, where=sizes > 0 )
+
+    return { 'count': count,
+             'npix': npix,
+             'pcent': 100.0*count/npix,
+             'class_disagreement': class_disagreement.tolist(),
+             'ari': adjusted_rand( conf ),
+             'nmi': normalized_mutual_info( conf ) }
+
+# scores of two cluster images; lut2 transcribes the second image's classes
+def agreement( labels1, labels2, nlabels, lut2=None ):
+
+    return scores( confusion( labels1, labels2, nlabels, lut2 ) )
+
+#------------------------------------------------
+if __name__ == '__main__':
+
+    # check the chunked scores against direct formulas on small images
+    nlabels = 25
+    rng = np.random.default_rng( 0 )
+    failed = False
+
+    first = rng.integers( 0, nlabels, (97,103,1) ).astype( np.uint8 )
+    second = first.copy()
+    flip = rng.random( first.shape ) < 0.1
+    second[ flip ] = rng.integers( 0, nlabels, np.count_nonzero( flip ) )
+
+    lut = rng.permutation( nlabels ).astype( np.uint8 )
+    inverse = np.argsort( lut ).astype( np.uint8 )
+    shuffled = inverse[ second ]                  # lut[shuffled] == second
+
+    result = agreement( first, shuffled, nlabels, lut )
+    if ( result['count'] != np.count_nonzero( first != second ) or
+         not np.array_equal( confusion( first, shuffled, nlabels, lut, chunk=1000 ),
+                             confusion( first, second, nlabels ) ) ):
+        print( 'agreement: chunked counts do not match', file=sys.stderr, flush=True )
+        failed = True
+
+    # the index scores ignore class numbering
+    plain = agreement( first, second, nlabels )
+    relabelled = agreement( first, shuffled, nlabels )
+    if ( abs( plain['ari'] - relabelled['ari'] ) > 1e-12 or
+         abs( plain['nmi'] - relabelled['nmi'] ) > 1e-12 ):
+        print( 'agreement: ari/nmi depend on class numbering', file=sys.stderr, flush=True )
+        failed = True
+
+    # ari by counting pixel pairs directly on a sample
+    a = first.ravel()[:400].astype( np.int64 )
+    b = second.ravel()[:400].astype( np.int64 )
+    same1 = a[:,None] == a[None,:]
+    same2 = b[:,None] == b[None,:]
+    upper = np.triu( np.ones( (400,400), dtype=bool ), 1 )
+    index = np.count_nonzero( same1 & same2 & upper )
+    n1 = np.count_nonzero( same1 & upper )
+    n2 = np.count_nonzero( same2 & upper )
+    expected = n1*n2/(400*399/2)
+    ref = (index - expected)/((n1 + n2)/2 - expected)
+    if abs( adjusted_rand( confusion( a, b, nlabels ) ) - ref ) > 1e-9:
+        print( 'agreement: ari does not match pair counting', file=sys.stderr, flush=True )
+        failed = True
+
+    same = agreement( first, first, nlabels )
+    if same['count'] != 0 or abs( same['ari'] - 1 ) > 1e-12 or abs( same['nmi'] - 1 ) > 1e-12:
+        print( 'agreement: identical images do not agree fully', file=sys.stderr, flush=True )
+        failed = True
+
+    if failed:
+        sys.exit( 1 )
+    print( 'agreement: scores match the direct computations', file=sys.stderr, flush=True )
@@ -0,0 +1,114 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  array_io.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+array_io_copyright = 'array_io.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# reading and writing of the pipeline's numpy arrays.
+# arrays are written as real .npy files in the smallest integer type that
+# holds their values (eg. uint16 day counts, uint8 labels), or as
+# compressed .npz files when compress is set. real .npy files are opened
+# memory mapped so they can be read partially or streamed in row bands;
+# .npz files and older files written by ndarray.dump() (pickles) are
+# loaded whole.
+
+import os
+import numpy as np
+
+stream_rows = 64                 # image rows per band when streaming a cube
+compress = False                 # write compressed .npz instead of .npy
+
+# ----------------------------------------------------------------------------
+
+# name an array written to path is stored under; .npz when compressing
+def stored_name( path, compressed=None ):
+
+    if compressed is None:
+        compressed = compress
+
+    base, ext = os.path.splitext( path )
+    if compressed and ext == '.npy':
+        return base + '.npz'
+
+    return path
+
+# smallest integer type holding all values of an integer array
+def compact_dtype( array ):
+
+    if array.dtype.kind not in 'ui' or array.size == 0:
+        return array.dtype
+
+    return np.result_type( np.min_scalar_type( array.min() ),
+                           np.min_scalar_type( array.max() ) )
+
+# write an array as .npy (or .npz when compressing), in its compact type
+# unless compact is False. returns the name written
+def save_array( path, array, compact=True, compressed=None ):
+
+    array = np.asarray( array )
+    if compact:
+        array = array.astype( compact_dtype( array ), copy=False )
+
+    name = stored_name( path, compressed )
+    if name.endswith( '.npz' ):
+        np.savez_compressed( name, array=array )
+    else:
+        with open( name, 'wb' ) as f:
+            np.save( f, array )
+
+    return name
+
+# file holding the array saved to path: path itself, or if that is a
+# missing .npy file, its compressed .npz version when there is one
+def array_file( path ):
+
+    if not os.path.exists( path ) and os.path.exists( stored_name( path, True ) ):
+        return stored_name( path, True )
+
+    return path
+
+# open a numpy array file written as .npy, .npz or by ndarray.dump().
+# real .npy files are memory mapped
+def load_array( path, mmap_mode='r' ):
+
+    data = np.load( array_file( path ), mmap_mode=mmap_mode, allow_pickle=True )
+
+    if isinstance( data, np.lib.npyio.NpzFile ):
+        with data:
+            return data['array']
+
+    return data
+
+# create a .npy file of the given shape and type, memory mapped for writing
+def create_array( path, shape, dtype ):
+
+    return np.lib.format.open_memmap( path, mode='w+', dtype=dtype, shape=shape )
+
+# write lut[labels] band by band into a new uint8 .npy file
+def transcribe_array( labels, lut, path ):
+
+    lut = np.asarray( lut ).astype( np.uint8 )
+    out = create_array( path, labels.shape, np.uint8 )
+
+    for j in range( 0, labels.shape[0], stream_rows ):
+        out[j:j+stream_rows] = lut[ labels[j:j+stream_rows].astype( np.uint8 ) ]
+
+    out.flush()
+    del out
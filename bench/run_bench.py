@@ -0,0 +1,278 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  run_bench.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+run_bench_copyright = 'run_bench.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# benchmarks of the pipeline's steps on synthetic data (see synth.py), eg.
+#
+#    python3 bench/run_bench.py -s small,medium
+#
+# each step is timed repeats times and its best and median wall times
+# saved to results/<commit>_<scale>.json, so that runs on different
+# commits can be compared with -c. SOM training needs msom_pack and is
+# skipped without it; everything else runs offline on numpy alone.
+
+import os
+import sys
+import json
+import time
+import getopt
+import platform
+import subprocess
+
+import numpy as np
+
+here = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.insert( 0, os.path.join( here, '..' ) )
+
+import synth
+import som_labels
+from array_io import load_array, transcribe_array
+from label_hist import label_histograms
+from som_classify import classify
+from show_diff import compare_files, compare_luts, distance
+from agreement import agreement
+import lut_store
+
+# (height,width,days) of each scale; 'full' is our grid over 5 years
+scales = { 'small':  ( 64, 64, 365 ),
+           'medium': ( 256, 256, 730 ),
+           'full':   ( 512, 512, 1826 ) }
+
+data_dir = os.path.join( here, 'data' )        # synthetic data sets, made once per scale
+results_dir = os.path.join( here, 'results' )  # saved results
+repeats = 5                                    # timings per step
+hist_rows = 64                                 # as in cluster_weather_labels
+
+# ----------------------------------------------------------------------------
+
+# best and median wall time of func(*args) over repeats calls
+def time_step( func, *args ):
+
+    times = []
+    for k in range( repeats ):
+        t0 = time.perf_counter()
+        func( *args )
+        times.append( time.perf_counter() - t0 )
+
+    return { 'best': min( times ), 'median': float( np.median( times ) ), 'n': repeats }
+
+# the diff step of run_diff.transcribe_climate, transcribing second on the way
+def diff_pixels( first, second, clut ):
+
+    return agreement( first, second, synth.nclasses, clut )['count']
+
+# train msom on the histograms, if msom_pack is installed
+def som_train( hist ):
+
+    from msom_pack import msom
+
+    ms = msom.msom( 'msom' )
+    ms.params.shape = (5,5)
+    ms.params.sigma = 2
+    ms.params.nepochs = 2
+    ms.params.rate = 0.3
+    ms.params.init_weights = 'pca'
+    ms.params.neighborhood_function = 'gaussian'
+    ms.params.topology = 'hexagonal'
+    ms.params.activation_distance = 'euclidean'
+    ms.params.output_type = 'labels'
+    ms.params.apply_classification = False
+    ms.params.seed = 0
+    ms.params.mapfile_prefix = os.path.join( data_dir, 'bench_som' )
+    ms.source = hist
+    ms.run()
+
+def have_msom():
+
+    try:
+        import msom_pack
+        return True
+    except ImportError:
+        return False
+
+# synthetic data set for a scale, made on first use
+def dataset( scale ):
+
+    height, width, days = scales[scale]
+    outdir = os.path.join( data_dir, scale ) + '/'
+    if not os.path.isfile( outdir + 'luts.npy' ):
+        synth.make_dataset( outdir, height, width, days )
+
+    return outdir
+
+def run_scale( scale ):
+
+    ddir = dataset( scale )
+    labels = load_array( ddir + 'labels.npy' )
+    store = lut_store.open_store( ddir + 'luts.npy' )
+    results = {}
+
+    def step( name, func, *args ):
+        print( 'run_bench:', scale, name, '...', file=sys.stderr, flush=True, end='' )
+        results[name] = time_step( func, *args )
+        print( ' %.4fs'%results[name]['best'], file=sys.stderr, flush=True )
+
+    step( 'histograms', label_histograms, labels, synth.nclasses, hist_rows )
+    hist = label_histograms( labels, synth.nclasses, hist_rows )
+
+    # apply the map (climate SOMs have nclasses dimensions)
+    neurons = np.random.default_rng( 0 ).random( (synth.nclasses,synth.nclasses) )*hist.mean()*2
+    out = np.empty( hist.shape[:2] + (1,), dtype=np.uint8 )
+    step( 'som_apply', classify, hist, neurons, None, out )
+
+    if have_msom():
+        step( 'som_train', som_train, hist.astype( np.int64 ) )
+    else:
+        print( 'run_bench: msom_pack not installed, skipping som_train',
+               file=sys.stderr, flush=True )
+
+    # weather SOM alignment, parsing the .labels files each time
+    f0, f1 = ddir + 'run_00.labels', ddir + 'run_01.labels'
+    def compare_cold():
+        som_labels.parsed.clear()
+        use_sidecar = som_labels.use_sidecar
+        som_labels.use_sidecar = False
+        compare_files( f1, f0 )
+        som_labels.use_sidecar = use_sidecar
+    step( 'compare_files_parse', compare_cold )
+    step( 'compare_files', compare_files, f1, f0 )
+
+    n0, h0 = som_labels.read_labels( f0 )
+    n1, h1 = som_labels.read_labels( f1 )
+    step( 'distance_greedy', distance, n1, n0, 'euclidean', 'greedy' )
+    step( 'distance_optimal', distance, n1, n0, 'euclidean', 'optimal' )
+
+    step( 'compare_luts', compare_luts, ddir + 'cluster_00.npy', ddir + 'cluster_01.npy',
+          synth.nclasses )
+
+    lut = lut_store.get_lut( store, 0, 1 )
+    step( 'transcribe', transcribe_array, labels, lut, ddir + 'transcribed_labels.npy' )
+
+    first = load_array( ddir + 'cluster_00.npy' )
+    second = load_array( ddir + 'cluster_01.npy' )
+    clut = lut_store.get_lut( store, 1, 0 )
+    step( 'diff', diff_pixels, first, second, clut )
+
+    # the synthetic truth is known; a wrong LUT means a broken alignment
+    if not np.array_equal( compare_files( f1, f0 ), lut ):
+        print( 'run_bench: compare_files LUT differs from the synthetic truth',
+               file=sys.stderr, flush=True )
+
+    return results
+
+# short commit id of the tree being measured, with + if it has changes
+def commit_id():
+
+    try:
+        cwd = os.path.join( here, '..' )
+        commit = subprocess.run( [ 'git', 'rev-parse', '--short', 'HEAD' ], cwd=cwd,
+                                 capture_output=True, text=True, check=True ).stdout.strip()
+        dirty = subprocess.run( [ 'git', 'status', '--porcelain', '--untracked-files=no' ],
+                                cwd=cwd, capture_output=True, text=True ).stdout.strip()
+        return commit + ( '+' if dirty else '' )
+
+    except ( OSError, subprocess.CalledProcessError ):
+        return 'unknown'
+
+def save_results( scale, results ):
+
+    if not os.path.isdir( results_dir ):
+        os.makedirs( results_dir )
+
+    commit = commit_id()
+    record = { 'commit': commit, 'scale': scale, 'shape': scales[scale],
+               'time': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+               'host': platform.node(), 'python': platform.python_version(),
+               'numpy': np.__version__, 'repeats': repeats, 'results': results }
+
+    path = os.path.join( results_dir, '%s_%s.json'%( commit, scale ) )
+    with open( path, 'w' ) as rfile:
+        json.dump( record, rfile, indent=1 )
+
+    print( 'run_bench: wrote', path, file=sys.stderr, flush=True )
+    return record
+
+# print best times of a run against a saved one
+def compare_results( record, path ):
+
+    with open( path, 'r' ) as rfile:
+        old = json.load( rfile )
+
+    print( '%-22s %10s %10s %8s'%( record['scale'], old['commit'], record['commit'], 'ratio' ) )
+    for name, new in record['results'].items():
+        if name in old['results']:
+            before = old['results'][name]['best']
+            print( '%-22s %10.4f %10.4f %8.2f'%( name, before, new['best'],
+                                                 new['best']/before ) )
+
+# ----------------------------------------------------------------------------
+
+def usage():
+    print( 'usage: run_bench.py', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -s scales, --scales=scales  (eg. small,medium,full)', file=sys.stderr )
+    print( '       -n repeats, --repeats=repeats', file=sys.stderr )
+    print( '       -c results.json, --compare=results.json  (compare with a saved run)',
+           file=sys.stderr )
+
+def get_params( argv ):
+
+    global repeats
+
+    names = [ 'small' ]
+    compare = None
+
+    try:
+        opts, args = getopt.getopt( argv, 'hs:n:c:',
+                                    ['help','scales=','repeats=','compare='] )
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-s', '--scales' ):
+            names = arg.split( ',' )
+        elif opt in ( '-n', '--repeats' ):
+            repeats = int( arg )
+        elif opt in ( '-c', '--compare' ):
+            compare = arg
+
+    for name in names:
+        if name not in scales:
+            print( 'run_bench: unknown scale', name, '...exiting' )
+            sys.exit(1)
+
+    return names, compare
+
+#------------------------------------------------
+if __name__ == '__main__':
+
+    names, compare = get_params( sys.argv[1:] )
+
+    for name in names:
+        record = save_results( name, run_scale( name ) )
+        if compare != None:
+            compare_results( record, compare )
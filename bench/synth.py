@@ -0,0 +1,224 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  synth.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+synth_copyright = 'synth.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# synthetic pipeline data for benchmarks, made offline from a seed:
+#
+#    labels.npy        (height,width,days) uint8 daily weather labels with
+#                      smooth spatial structure and a seasonal cycle
+#    run_NN.labels     msom style SOM map files, the same map with its
+#                      neurons shuffled and jittered per run
+#    luts.npy          LUT store (see lut_store.py) of the true shuffles
+#    cluster_NN.npy    (height,width,1) uint8 cluster images, one per run,
+#                      the same classes relabelled per run plus noise
+#
+# the shapes default to the pipeline's: 25 classes, 25x192 weather SOMs,
+# 5 years of days.
+
+import os
+import sys
+import getopt
+
+import numpy as np
+
+# pipeline modules live one directory up
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from array_io import create_array, save_array
+import lut_store
+
+nclasses = 25                    # weather and climate classes
+ndims = 192                      # dimensions of the weather SOM neurons
+nyears = 5                       # years of daily labels
+band_rows = 64                   # rows generated per pass
+flip = 0.02                      # fraction of cluster pixels relabelled at random
+
+# ----------------------------------------------------------------------------
+
+# smooth field in [0,1) over the grid from a few random plane waves
+def smooth_field( height, width, rng, nwaves=6 ):
+
+    y, x = np.mgrid[ 0:height, 0:width ].astype( np.float32 )
+    field = np.zeros( (height,width), dtype=np.float32 )
+
+    for k in range( nwaves ):
+        fy, fx = rng.uniform( 0.5, 4.0, 2 )*2*np.pi/np.array( [height,width] )
+        field += np.sin( fy*y + fx*x + rng.uniform( 0, 2*np.pi ) )
+
+    field -= field.min()
+    return field/( field.max() + 1e-6 )
+
+# write a (height,width,days) uint8 label cube to path, band by band
+def make_labels( path, height, width, days, rng ):
+
+    cube = create_array( path, (height,width,days), np.uint8 )
+
+    # each pixel's climate sets its typical class; days move it through
+    # the seasons and add weather noise
+    climate = smooth_field( height, width, rng )*(nclasses-1)
+    amplitude = 2.0 + 4.0*smooth_field( height, width, rng )
+    season = np.sin( 2*np.pi*np.arange( days )/365.25 ).astype( np.float32 )
+
+    for j in range( 0, height, band_rows ):
+        c = climate[j:j+band_rows,:,None]
+        a = amplitude[j:j+band_rows,:,None]
+        noise = rng.normal( 0.0, 1.5, ( c.shape[0],width,days ) ).astype( np.float32 )
+
+        band = c + a*season + noise
+        cube[j:j+band_rows] = np.clip( np.rint( band ), 0, nclasses-1 ).astype( np.uint8 )
+
+    cube.flush()
+    del cube
+
+# write neurons as an msom .labels file
+def write_labels_file( path, neurons, seed ):
+
+    with open( path, 'w' ) as lfile:
+        lfile.write( 'timestamp=                2023-01-01T00:00:00.000000\n' )
+        lfile.write( 'shape=                    (5, 5)\n' )
+        lfile.write( 'sigma=                    2.5\n' )
+        lfile.write( 'nepochs=                  4\n' )
+        lfile.write( 'rate=                     0.00724\n' )
+        lfile.write( 'neighborhood function=    gaussian\n' )
+        lfile.write( 'init weights=             pca\n' )
+        lfile.write( 'topology=                 hexagonal\n' )
+        lfile.write( 'activation distance=      euclidean\n' )
+        lfile.write( 'output type=              labels\n' )
+        lfile.write( 'mapfile_prefix=           %s\n'%os.path.basename( path )[:-7] )
+        lfile.write( 'apply classification=     False\n' )
+        lfile.write( 'apply activation=         False\n' )
+        lfile.write( 'seed=                     %d\n'%seed )
+        lfile.write( 'random order=             True\n' )
+        lfile.write( 'custom init file=         None\n' )
+        lfile.write( 'decay_function=           3\n' )
+        lfile.write( '\n' )
+        lfile.write( 'quantization error=       0.35\n' )
+        lfile.write( 'topographic error=        0.20\n' )
+        lfile.write( '\n' )
+        lfile.write( '############ NEURONS #############\n' )
+        lfile.write( ' %d %d\n'%neurons.shape )
+        for k, neuron in enumerate( neurons ):
+            lfile.write( '%3d '%k + ' '.join( '%10.6f'%v for v in neuron ) + '\n' )
+
+# make nruns shuffled copies of one SOM map and nruns cluster images of
+# one clustering; returns the LUT store of the shuffles, where
+# store[a,b][class of run a] = class of run b
+def make_runs( outdir, height, width, nruns, rng ):
+
+    base = rng.random( (nclasses,ndims) )
+    truth = np.floor( smooth_field( height, width, rng )*nclasses ).astype( np.uint8 )
+
+    perms = []
+    for r in range( nruns ):
+
+        # run r calls the base class k perm[k]
+        perm = rng.permutation( nclasses ).astype( np.uint8 )
+        perms.append( perm )
+
+        neurons = np.empty( (nclasses,ndims) )
+        neurons[ perm ] = base + rng.normal( 0.0, 0.01, base.shape )
+        write_labels_file( outdir + 'run_%02d.labels'%r, neurons, r )
+
+        image = perm[ truth ]
+        noisy = rng.random( image.shape ) < flip
+        image[ noisy ] = rng.integers( 0, nclasses, np.count_nonzero( noisy ) )
+        save_array( outdir + 'cluster_%02d.npy'%r, image[:,:,None] )
+
+    store = lut_store.make_store( nruns, nclasses )
+    for a in range( nruns ):
+        for b in range( nruns ):
+            if a != b:
+                lut = np.empty( nclasses, dtype=np.uint8 )
+                lut[ perms[a] ] = perms[b]
+                store[a,b] = lut
+    lut_store.write_store( outdir + 'luts.npy', store )
+
+    return store
+
+# make a full synthetic data set in outdir
+def make_dataset( outdir, height, width, days=None, nruns=4, seed=0 ):
+
+    if days is None:
+        days = int( 365.25*nyears )
+
+    if not outdir.endswith( '/' ):
+        outdir += '/'
+    if not os.path.isdir( outdir ):
+        os.makedirs( outdir )
+
+    rng = np.random.default_rng( seed )
+
+    print( 'synth: making', height, 'x', width, 'x', days, 'labels in', outdir,
+           file=sys.stderr, flush=True )
+    make_labels( outdir + 'labels.npy', height, width, days, rng )
+    make_runs( outdir, height, width, nruns, rng )
+
+    return outdir
+
+# ----------------------------------------------------------------------------
+
+def usage():
+    print( 'usage: synth.py', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -o outdir, --outdir=outdir', file=sys.stderr )
+    print( '       -s height,width, --size=height,width', file=sys.stderr )
+    print( '       -d days, --days=days  (default %d years)'%nyears, file=sys.stderr )
+    print( '       -r nruns, --runs=nruns', file=sys.stderr )
+
+def get_params( argv ):
+
+    outdir = None
+    size = ( 256, 256 )
+    days = None
+    nruns = 4
+
+    try:
+        opts, args = getopt.getopt( argv, 'ho:s:d:r:',
+                                    ['help','outdir=','size=','days=','runs='] )
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-o', '--outdir' ):
+            outdir = arg
+        elif opt in ( '-s', '--size' ):
+            size = tuple( int( v ) for v in arg.split( ',' ) )
+        elif opt in ( '-d', '--days' ):
+            days = int( arg )
+        elif opt in ( '-r', '--runs' ):
+            nruns = int( arg )
+
+    if outdir == None:
+        print( 'synth: outdir is missing...exiting' )
+        sys.exit(1)
+
+    return outdir, size, days, nruns
+
+#------------------------------------------------
+if __name__ == '__main__':
+
+    outd, size, days, nruns = get_params( sys.argv[1:] )
+    make_dataset( outd, size[0], size[1], days, nruns )
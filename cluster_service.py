@@ -0,0 +1,376 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  cluster_service.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+cluster_service_copyright = 'cluster_service.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# long running cluster worker. the msom and render operators and the
+# palettes are made once and kept warm; cluster jobs are taken from a
+# spool directory:
+#
+#    spool/new/<job>.json           submitted jobs (see submit_job)
+#    spool/work/<job>@<host>@<pid>  jobs being run by worker pid on host
+#    spool/done/<job>.json          completion records
+#
+# a job is claimed by renaming it into work/, so several workers, also
+# on several hosts sharing the spool, can serve it. a job is a JSON dict:
+#
+#    { "input": "2019_labels.npy", "outdir": "./2019-GA/SOM_02/",
+#      "days": [0,365], "init": null, "lut": "./luts/sixteenthbow.lut",
+#      "params": { "sigma": 2.5, "seed": 3 },      msom settings (som_param_names)
+#      "settings": { "compress_hist": true } }     cluster_weather_labels settings
+#
+# overrides only apply to their job. eg. from run_diff or cron:
+#
+#    from cluster_service import submit_job
+#    submit_job( './SPOOL/', '2019_labels.npy', './2019-GA/SOM_02/', params={'seed':2} )
+
+import os
+import sys
+import json
+import time
+import getopt
+import socket
+
+import stage_timer
+from stage_timer import timed
+
+poll_seconds = 1.0               # wait between looks at an empty spool
+
+# cluster_weather_labels settings a job may override
+job_settings = [ 'nclasses', 'hist_rows', 'compress_hist', 'hist_quantum',
+                 'classify_blocks', 'classify_block', 'warm_nepochs',
+                 'tile_rows', 'sample_size' ]
+
+palettes = {}                    # render operators with their lut loaded, by lut file
+nsubmitted = 0                   # jobs submitted by this process
+
+# cluster_weather_labels and render, imported by warm_up in workers only so
+# that submitting a job stays cheap
+cwl = None
+render = None
+
+# ----------------------------------------------------------------------------
+
+def spool_dirs( spool ):
+
+    return [ os.path.join( spool, name ) for name in ( 'new', 'work', 'done' ) ]
+
+def make_spool( spool ):
+
+    for path in spool_dirs( spool ):
+        if not os.path.isdir( path ):
+            os.makedirs( path )
+
+# put a cluster job in the spool; returns its id
+def submit_job( spool, infile, outdir, days=None, init=None, lut=None,
+                params=None, settings=None ):
+
+    global nsubmitted
+
+    make_spool( spool )
+    new = spool_dirs( spool )[0]
+
+    # ids sort in submission order
+    nsubmitted += 1
+    jobid = '%s_%d_%04d'%( time.strftime( '%Y%m%dT%H%M%S' ), os.getpid(), nsubmitted )
+
+    job = { 'id': jobid, 'input': infile, 'outdir': outdir,
+            'days': list( days ) if days else None, 'init': init, 'lut': lut,
+            'params': params or {}, 'settings': settings or {},
+            'submitted': time.strftime( '%Y-%m-%dT%H:%M:%S' ) }
+
+    # written aside then renamed so workers never see half a job
+    tmppath = os.path.join( spool, '.' + jobid + '.tmp' )
+    with open( tmppath, 'w' ) as jfile:
+        json.dump( job, jfile, indent=1 )
+    os.rename( tmppath, os.path.join( new, jobid + '.json' ) )
+
+    return jobid
+
+# completion record of a job, or None while it is not done
+def job_record( spool, jobid ):
+
+    path = os.path.join( spool_dirs( spool )[2], jobid + '.json' )
+    if not os.path.isfile( path ):
+        return None
+
+    with open( path, 'r' ) as rfile:
+        return json.load( rfile )
+
+# claim the oldest job; returns (jobid,workpath) or (None,None) if none
+# is waiting. the job file is read and checked by serve_job
+def claim_job( spool ):
+
+    new, work, done = spool_dirs( spool )
+
+    for name in sorted( os.listdir( new ) ):
+        if not name.endswith( '.json' ):
+            continue
+
+        workpath = os.path.join( work, '%s@%s@%d'%( name[:-5], socket.gethostname(),
+                                                     os.getpid() ) )
+        try:
+            os.rename( os.path.join( new, name ), workpath )
+        except FileNotFoundError:
+            continue                # another worker took it
+
+        return name[:-5], workpath
+
+    return None, None
+
+# read a claimed job file; raises ValueError for one that is not a job
+def read_job( workpath ):
+
+    with open( workpath, 'r' ) as jfile:
+        job = json.load( jfile )
+
+    if not isinstance( job, dict ):
+        raise ValueError( 'job is not a JSON object' )
+    for name in ( 'input', 'outdir' ):
+        if not isinstance( job.get( name ), str ):
+            raise ValueError( 'job has no ' + name )
+    for name in ( 'params', 'settings' ):
+        if not isinstance( job.get( name, {} ) or {}, dict ):
+            raise ValueError( 'job ' + name + ' is not a JSON object' )
+
+    return job
+
+# put jobs of this host's workers that are gone back in new/. the pids
+# of other hosts' workers cannot be checked from here
+def requeue_orphans( spool ):
+
+    new, work, done = spool_dirs( spool )
+    host = socket.gethostname()
+
+    for name in os.listdir( work ):
+        try:
+            jobid, jobhost, pid = name.rsplit( '@', 2 )
+            pid = int( pid )
+        except ValueError:
+            continue                # not a claimed job
+        if jobhost != host:
+            continue
+
+        try:
+            os.kill( pid, 0 )
+            continue                # its worker is still running
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue
+
+        print( 'cluster_service: requeueing', jobid, file=sys.stderr, flush=True )
+        os.rename( os.path.join( work, name ), os.path.join( new, jobid + '.json' ) )
+
+# make the operators (on importing cluster_weather_labels) once per worker
+def warm_up():
+
+    global cwl, render
+
+    import cluster_weather_labels
+    from render_pack import render as render_module
+
+    cwl = cluster_weather_labels
+    render = render_module
+
+    # the palette cluster_weather_labels loaded
+    palettes[ './luts/sixteenthbow.lut' ] = cwl.rndr
+
+# render operator with a palette loaded, made once per lut file
+def palette( lut ):
+
+    if lut not in palettes:
+        rndr = render.render( 'render' )
+        rndr.readlut( lut )
+        palettes[lut] = rndr
+
+    return palettes[lut]
+
+# set module attributes of obj from overrides; returns the old values
+def override( obj, overrides, allowed=None ):
+
+    for name in overrides:
+        if allowed is not None and name not in allowed:
+            raise ValueError( 'setting ' + name + ' cannot be overridden' )
+
+    saved = {}
+    for name, value in overrides.items():
+        if isinstance( value, list ):
+            value = tuple( value )          # eg. shape
+        saved[name] = getattr( obj, name, None )
+        setattr( obj, name, value )
+
+    return saved
+
+def restore( obj, saved ):
+
+    for name, value in saved.items():
+        setattr( obj, name, value )
+
+# run a cluster job with its overrides on the warm operators. all msom
+# settings are put back afterwards, whatever the job or a failure changed
+def run_job( job ):
+
+    names = cwl.som_param_names + [ 'apply_classification', 'mapfile_prefix' ]
+    msaved = { name: getattr( cwl.ms.params, name, None ) for name in names }
+    ssaved = {}
+    rndr = cwl.rndr
+    try:
+        override( cwl.ms.params, job.get( 'params', {} ), cwl.som_param_names )
+        ssaved = override( cwl, job.get( 'settings', {} ), job_settings )
+        if job.get( 'lut' ):
+            cwl.rndr = palette( job['lut'] )
+
+        if not os.path.isdir( job['outdir'] ):
+            os.makedirs( job['outdir'] )
+
+        days = tuple( job['days'] ) if job.get( 'days' ) else None
+        cwl.cluster( job['input'], job['outdir'], days, job.get( 'init' ) )
+
+    finally:
+        cwl.rndr = rndr
+        restore( cwl, ssaved )
+        restore( cwl.ms.params, msaved )
+
+# run one claimed job and write its completion record. the job's id is
+# its file name; an unreadable job gets a failed record like any other
+def serve_job( spool, jobid, workpath ):
+
+    record = { 'id': jobid }
+    record['host'] = socket.gethostname()
+    record['pid'] = os.getpid()
+    record['started'] = time.strftime( '%Y-%m-%dT%H:%M:%S' )
+
+    print( 'cluster_service: running', jobid, file=sys.stderr, flush=True )
+    t0 = time.perf_counter()
+    stage_timer.set_context( job=jobid )
+    try:
+        job = read_job( workpath )
+        record.update( job )
+        record['id'] = jobid
+
+        with timed( 'job' ):
+            run_job( job )
+        record['status'] = 'done'
+        record['error'] = None
+
+    # a bad job (eg. sys.exit from a missing file) must not stop the service
+    except ( Exception, SystemExit ) as err:
+        record['status'] = 'failed'
+        record['error'] = repr( err )
+
+    finally:
+        stage_timer.set_context( job=None )
+
+    record['finished'] = time.strftime( '%Y-%m-%dT%H:%M:%S' )
+    record['wall'] = round( time.perf_counter() - t0, 3 )
+
+    done = spool_dirs( spool )[2]
+    tmppath = os.path.join( done, '.' + jobid + '.tmp' )
+    with open( tmppath, 'w' ) as rfile:
+        json.dump( record, rfile, indent=1, default=str )
+    os.rename( tmppath, os.path.join( done, jobid + '.json' ) )
+    os.remove( workpath )
+
+    print( 'cluster_service:', jobid, record['status'], 'in', record['wall'], 's',
+           record['error'] or '', file=sys.stderr, flush=True )
+
+# serve the spool until stopped, or until it is empty if once is set
+def run_service( spool, once=False ):
+
+    make_spool( spool )
+    requeue_orphans( spool )
+    warm_up()
+    stage_timer.set_log( os.path.join( spool, 'timing.jsonl' ) )
+
+    print( 'cluster_service: serving', spool, file=sys.stderr, flush=True )
+    while True:
+        jobid, workpath = claim_job( spool )
+        if jobid is None:
+            if once:
+                return
+            time.sleep( poll_seconds )
+            continue
+
+        serve_job( spool, jobid, workpath )
+
+# ----------------------------------------------------------------------------
+
+def usage():
+    print( 'usage: cluster_service.py', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -s spool, --spool=spool   (spool directory)', file=sys.stderr )
+    print( '       -1, --once                (exit when the spool is empty)', file=sys.stderr )
+    print( '       -i datafile -o outdir [-d first:last]  (submit a job and exit)',
+           file=sys.stderr )
+
+def get_params( argv ):
+
+    spool = None
+    once = False
+    datafile = None
+    outdir = None
+    days = None
+
+    try:
+        opts, args = getopt.getopt( argv, 'hs:1i:o:d:',
+                                    ['help','spool=','once','input=','outdir=','days='] )
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-s', '--spool' ):
+            spool = arg
+        elif opt in ( '-1', '--once' ):
+            once = True
+        elif opt in ( '-i', '--input' ):
+            datafile = arg
+        elif opt in ( '-o', '--outdir' ):
+            outdir = arg
+        elif opt in ( '-d', '--days' ):
+            first, last = arg.split( ':' )
+            days = ( int( first ), int( last ) )
+
+    if spool == None:
+        print( 'cluster_service: spool is missing...exiting' )
+        sys.exit(1)
+    if ( datafile == None ) != ( outdir == None ):
+        print( 'cluster_service: a job needs both datafile and outdir...exiting' )
+        sys.exit(1)
+
+    return spool, once, datafile, outdir, days
+
+####################################################################
+# command line user entry point
+####################################################################
+if __name__ == '__main__':
+
+    spool, once, dataf, outd, days = get_params( sys.argv[1:] )
+
+    if dataf != None:
+        print( submit_job( spool, dataf, outd, days ) )
+    else:
+        run_service( spool, once )
@@ -30,17 +30,33 @@ import getopt
 
 import numpy as np
 
-from npy_source_pack import npy_source
 from msom_pack import msom
 from render_pack import render
 
+from array_io import load_array, save_array, create_array
+from label_hist import label_histograms, index_path
+from label_hist import make_cumulative_index, open_cumulative_index, window_histograms
+from label_hist import read_hist_state, update_hist_state
+from som_labels import read_labels as read_som_labels
+from som_compress import unique_vectors, weighted_sample, reservoir_update
+from som_classify import classify
+from stage_timer import timed
+
 nclasses = 25                       # must match classes in SOM map (eg. *.labels)
+hist_rows = 64                      # image rows histogrammed per pass; None for all
+compress_hist = False               # train on unique histograms drawn by multiplicity
+hist_quantum = None                 # round day counts to this before finding unique ones
+classify_blocks = True              # label pixels with som_classify after training
+                                    # instead of msom's own apply step (only for
+                                    # euclidean activation_distance)
+classify_block = 65536              # pixels per block when classifying
+warm_nepochs = 5                    # epochs when warm starting from a .labels file
+tile_rows = None                    # image rows per tile for out-of-core clustering;
+                                    # None holds the whole histogram image in memory
+sample_size = 200000                # histograms sampled for training when tiling
 
 # instantiate the operators
 
-# numpy source
-src = npy_source.npy_source( 'npy_source' )
-
 # mini-som
 ms = msom.msom( 'msom' )
 ms.params.shape = (3,4)             # net grid shape (3,4) 
@@ -57,6 +73,7 @@ ms.params.thresh = None             # set to stop processing below this value
 
 ms.params.rate = 0.3                # 0.5 for jan-mar_2019 for decay 3
 ms.params.init_weights = 'pca'
+ms.params.custom_init_file = None   # .labels file for init_weights 'custom'
 ms.params.neighborhood_function = 'gaussian'
 ms.params.topology = 'hexagonal'
 ms.params.activation_distance = 'euclidean'
@@ -72,45 +89,185 @@ ms.params.calc_epoch_QE = True
 rndr = render.render( 'render' )
 rndr.readlut( './luts/sixteenthbow.lut' )
 
+# msom settings that determine a clustering, eg. for cache keys
+som_param_names = [ 'shape', 'sigma', 'nepochs', 'thresh', 'rate', 'init_weights',
+                    'neighborhood_function', 'topology', 'activation_distance',
+                    'output_type', 'apply_classification', 'seed', 'rorder',
+                    'order_by_size', 'decay_function', 'custom_init_file' ]
+
 # -----------------------------------------------------------
 
-def cluster( infile, outdir ) :
+def som_params():
+
+   params = { name: getattr( ms.params, name ) for name in som_param_names }
+   params['compress_hist'] = compress_hist
+   params['hist_quantum'] = hist_quantum
+   params['classify_blocks'] = classify_blocks
+   params['warm_nepochs'] = warm_nepochs
+   params['tile_rows'] = tile_rows
+   params['sample_size'] = sample_size
+
+   return params
+
+# open a daily labels file; .npy files are memory mapped and
+# histogrammed band by band, older pickled files are read whole
+def read_labels( infile ):
 
-   print( 'output directory for clustering:', outdir,
-          file=sys.stderr, flush=True )
-   
-   # read the daily labels file as training data
    print( 'reading datafile: ' + infile + '...',
           file=sys.stderr, flush=True, end='' )
-   src.params.filepath = infile
-   src.run()
+   labels = load_array( infile )
    print( 'done', file=sys.stderr, flush=True )
 
-   print( 'number of epochs=', ms.params.nepochs, file=sys.stderr, flush=True )
+   return labels
+
+# histograms for the days in [day_a,day_b) from the labels file's
+# cumulative index, making the index first if needed
+def window_hist( infile, days ):
+
+   cum = open_cumulative_index( infile )
+   if cum is None:
+      print( 'making cumulative index ' + index_path( infile ) + '...',
+             file=sys.stderr, flush=True, end='' )
+      make_cumulative_index( read_labels( infile ), nclasses, index_path( infile ), hist_rows )
+      print( 'done', file=sys.stderr, flush=True )
+      cum = open_cumulative_index( infile )
+
+   day_a, day_b = days
+   print( 'histograms for days %d:%d from index...'%(day_a,day_b),
+          file=sys.stderr, flush=True, end='' )
+   return window_histograms( cum, day_a, day_b )
+
+# cluster the label histograms of infile. days=(day_a,day_b) restricts
+# the histograms to days [day_a,day_b) using the cumulative index.
+# init is a .labels file to warm start training from (see warm_start)
+def cluster( infile, outdir, days=None, init=None ) :
+
+   print( 'output directory for clustering:', outdir,
+          file=sys.stderr, flush=True )
+
+   print( 'number of epochs=', warm_nepochs if init else ms.params.nepochs,
+          file=sys.stderr, flush=True )
    print( 'learning rate=', ms.params.rate, file=sys.stderr, flush=True )
 
+   if tile_rows is not None:
+      cluster_tiled( infile, outdir, days, init )
+      return
+
    # for each pixel make a label histogram, use this as a feature vector
-   print( 'making histograms...', file=sys.stderr, flush=True, end='' )
-   height, width, nbins = src.sink.shape
-   hist = np.empty( (height,width,nclasses), dtype=np.int64 )
+   # histograms are made in bands of hist_rows rows to bound memory
+   with timed( 'histograms' ):
+      if days is not None:
+         hist = window_hist( infile, days )
+      else:
+         # read the daily labels file as training data
+         labels = read_labels( infile )
+         print( 'making histograms...', file=sys.stderr, flush=True, end='' )
+         hist = label_histograms( labels, nclasses, hist_rows )
+
+   # NOTE: if you get this error:
+   #       minisom.py:486: RuntimeWarning: invalid value encountered in sqrt
+   #       return sqrt(-2 * cross_term + input_data_sq + weights_flat_sq.T)
+   # it is saying that the data type cannot fit the result a square operation.
+   # eg, dtype=uint16 but 364*364=132496 which is bigger than 2^16 - 1 = 65535
+
+   print( 'done', file=sys.stderr, flush=True )
 
-   # construct an image of histograms and cluster these
-   for j in range( height ):
-       for i in range( width ):
+   cluster_hist( hist, outdir, init )
 
-          # for each pixel make a histogram of labels
-          h,b = np.histogram( src.sink[j,i,:], bins=nclasses,
-                              range=(0.0,float(nclasses-1)) )
-          hist[j,i,:] = h
+# add (sign=1) or remove (sign=-1) days [day_a,day_b) of infile, all
+# days if None, in the persistent histogram state statefile
+def update_state( statefile, infile, days=None, sign=1 ):
 
-          # NOTE: if you get this error:
-          #       minisom.py:486: RuntimeWarning: invalid value encountered in sqrt
-          #       return sqrt(-2 * cross_term + input_data_sq + weights_flat_sq.T)
-          # it is saying that the data type cannot fit the result a square operation.
-          # eg, dtype=uint16 but 364*364=132496 which is bigger than 2^16 - 1 = 65535
+   labels = read_labels( infile )
 
+   print( 'adding' if sign > 0 else 'removing', 'days', days or 'all', 'of', infile,
+          'in', statefile, '...', file=sys.stderr, flush=True, end='' )
+   counts, record = update_hist_state( statefile, infile, labels, nclasses,
+                                       days, sign, hist_rows )
+   print( 'done,', record['ndays'], 'days held', file=sys.stderr, flush=True )
 
-   print( 'done', file=sys.stderr, flush=True )
+# cluster the histograms held in a persistent histogram state
+def cluster_state( statefile, outdir, init=None ):
+
+   counts, record = read_hist_state( statefile )
+   if counts is None:
+      print( 'cluster_labels: no histogram state', statefile, '...exiting',
+             file=sys.stderr, flush=True )
+      sys.exit( 1 )
+
+   print( 'output directory for clustering:', outdir, file=sys.stderr, flush=True )
+   print( 'clustering', record['ndays'], 'days of histograms from', statefile,
+          file=sys.stderr, flush=True )
+   cluster_hist( counts, outdir, init )
+
+# switch msom to start from the neurons of a .labels file (eg. a previous
+# cluster.labels) for warm_nepochs epochs. a map that converged on similar
+# data needs few epochs to settle and keeps its label order. returns the
+# settings to restore afterwards, or None (cold start) if the map does
+# not fit the current net
+def warm_start( init ):
+
+   if init is None:
+      return None
+
+   if not os.path.exists( init ):
+      print( 'warm start file', init, 'not found, training from',
+             ms.params.init_weights, file=sys.stderr, flush=True )
+      return None
+
+   neurons, header = read_som_labels( init )
+   if ( neurons.shape[1] != nclasses or
+        tuple( header.get( 'shape', () ) ) != tuple( ms.params.shape ) ):
+      print( 'warm start file', init, 'has a', header.get( 'shape' ), 'net of',
+             neurons.shape[1], 'dimensions, training from', ms.params.init_weights,
+             file=sys.stderr, flush=True )
+      return None
+
+   saved = ( ms.params.init_weights, ms.params.custom_init_file, ms.params.nepochs )
+
+   print( 'warm start from', init, file=sys.stderr, flush=True )
+   ms.params.init_weights = 'custom'
+   ms.params.custom_init_file = init
+   ms.params.nepochs = warm_nepochs
+
+   return saved
+
+# put back the settings warm_start changed
+def end_warm_start( saved ):
+
+   if saved is not None:
+      ms.params.init_weights, ms.params.custom_init_file, ms.params.nepochs = saved
+
+# som_classify finds best matching units by euclidean distance only; for
+# other activation distances msom's apply step must label the pixels
+def euclidean_bmu():
+
+   return ms.params.activation_distance == 'euclidean'
+
+# paths labelling pixels with som_classify cannot follow another distance
+def need_euclidean( what ):
+
+   if not euclidean_bmu():
+      print( 'cluster_labels:', what, 'needs activation_distance euclidean, not',
+             ms.params.activation_distance, '...exiting', file=sys.stderr, flush=True )
+      sys.exit( 1 )
+
+# train msom on source without its apply step (the map is all that is
+# needed), putting apply_classification back even if training fails
+def train_map( source ):
+
+   apply_classification = ms.params.apply_classification
+   ms.params.apply_classification = False
+   try:
+      with timed( 'train' ):
+         ms.source = source
+         ms.run() # train
+   finally:
+      ms.params.apply_classification = apply_classification
+
+# cluster an image of label histograms, eg. one already made or remapped.
+# init is a .labels file to warm start training from
+def cluster_hist( hist, outdir, init=None ) :
 
    '''                                                                                        
    # report max and min
@@ -122,23 +279,149 @@ def cluster( infile, outdir ) :
    # rational for not normalizing: feature vector components
    # have same units, ie. number of days
 
-   # make numpy file for graphics
-   hist.dump( outdir + '/hist.npy' )
+   if compress_hist:
+      need_euclidean( 'compress_hist' )
+
+   # make numpy file for graphics (counts stored in their compact type)
+   save_array( outdir + '/hist.npy', hist )
+
+   # train on wide integers; see the NOTE on uint16 above
+   hist = np.asarray( hist, dtype=np.int64 )
 
    # link output to msom input and run
    print( 'training ...', file=sys.stderr, flush=True )
 
    ms.params.mapfile_prefix = outdir + '/cluster'
-   ms.source = hist
-   ms.run() # train
+   saved = warm_start( init )
+   try:
+      if compress_hist:
+         labels = train_compressed( hist )
+      elif classify_blocks and ms.params.apply_classification and euclidean_bmu():
+         labels = train_then_classify( hist )
+      else:
+         with timed( 'train' ):
+            ms.source = hist
+            ms.run() # train
+            labels = ms.sink
+   finally:
+      end_warm_start( saved )
 
    # save the cluster labels
-   ms.sink.dump( outdir + '/cluster.npy' )
+   save_array( outdir + '/cluster.npy', labels )
+
+   # render as image
+   with timed( 'render' ):
+      rndr.params.filepath = outdir + '/cluster.jpg'
+      rndr.source = labels
+      rndr.run()
+
+# train on the unique histograms, drawn in proportion to the number of
+# pixels sharing them, then label the unique histograms with the trained
+# map and scatter the labels back to the image
+def train_compressed( hist ):
+
+   height, width, nbands = hist.shape
+   uniq, weights, inverse = unique_vectors( hist.reshape( -1, nbands ), hist_quantum )
+
+   print( 'training on', len( uniq ), 'unique histograms of', height*width,
+          file=sys.stderr, flush=True )
+
+   # the sample itself needs no labels, only the map
+   sample = weighted_sample( uniq, weights, len( uniq ), ms.params.seed )
+   train_map( sample.reshape( -1, 1, nbands ) )
+
+   # classify each unique histogram once with the map msom wrote
+   with timed( 'classify' ):
+      neurons, header = read_som_labels( ms.params.mapfile_prefix + '.labels' )
+      labels = classify( uniq, neurons, header['labels'], block=classify_block )
+
+   return labels[ inverse ].reshape( height, width, 1 )
+
+# train msom only, then label every pixel with its best matching neuron
+# in blocks, straight into a preallocated uint8 label image
+def train_then_classify( hist ):
+
+   height, width, nbands = hist.shape
+
+   train_map( hist )
+
+   print( 'classifying ...', file=sys.stderr, flush=True )
+   with timed( 'classify' ):
+      neurons, header = read_som_labels( ms.params.mapfile_prefix + '.labels' )
+      labels = np.empty( (height,width,1), dtype=np.uint8 )
+
+      return classify( hist, neurons, header['labels'], labels, classify_block )
+
+# out-of-core clustering: histograms are made tile by tile from the memory
+# mapped labels file (or cumulative index) into a memory mapped hist.npy
+# while a reservoir keeps a uniform sample of sample_size of them to train
+# on; pixels are then classified tile by tile into a memory mapped
+# cluster.npy. memory used depends on tile_rows and sample_size, not on
+# the size of the domain
+def cluster_tiled( infile, outdir, days=None, init=None ):
+
+   need_euclidean( 'tile_rows' )
+
+   if days is not None:
+      cum = open_cumulative_index( infile )
+      if cum is None:
+         print( 'making cumulative index ' + index_path( infile ) + '...',
+                file=sys.stderr, flush=True, end='' )
+         make_cumulative_index( read_labels( infile ), nclasses, index_path( infile ),
+                                tile_rows )
+         print( 'done', file=sys.stderr, flush=True )
+         cum = open_cumulative_index( infile )
+      height, width = cum.shape[1:3]
+      maxcount = days[1] - days[0]
+      tile_hist = lambda j: window_histograms( cum[:,j:j+tile_rows], days[0], days[1] )
+   else:
+      labels = read_labels( infile )
+      height, width, maxcount = labels.shape
+      tile_hist = lambda j: label_histograms( labels[j:j+tile_rows], nclasses, hist_rows )
+
+   # day counts fit the compact type save_array would pick
+   hist = create_array( outdir + '/hist.npy', (height,width,nclasses),
+                        np.min_scalar_type( maxcount ) )
+
+   rng = np.random.default_rng( ms.params.seed )
+   sample = np.empty( (min( sample_size, height*width ),nclasses), dtype=np.int64 )
+   nseen = 0
+
+   print( 'making histograms in tiles of', tile_rows, 'rows...',
+          file=sys.stderr, flush=True, end='' )
+   with timed( 'histograms' ):
+      for j in range( 0, height, tile_rows ):
+         tile = tile_hist( j )
+         hist[j:j+tile_rows] = tile
+         nseen = reservoir_update( sample, nseen, tile, rng )
+      hist.flush()
+   print( 'done', file=sys.stderr, flush=True )
+
+   print( 'training on', len( sample ), 'sampled histograms of', height*width,
+          file=sys.stderr, flush=True )
+
+   ms.params.mapfile_prefix = outdir + '/cluster'
+   saved = warm_start( init )
+   try:
+      train_map( sample.reshape( -1, 1, nclasses ) )
+   finally:
+      end_warm_start( saved )
+
+   print( 'classifying in tiles...', file=sys.stderr, flush=True, end='' )
+   with timed( 'classify' ):
+      neurons, header = read_som_labels( ms.params.mapfile_prefix + '.labels' )
+      labels = create_array( outdir + '/cluster.npy', (height,width,1), np.uint8 )
+      for j in range( 0, height, tile_rows ):
+         classify( hist[j:j+tile_rows], neurons, header['labels'],
+                   labels[j:j+tile_rows], classify_block )
+      labels.flush()
+   print( 'done', file=sys.stderr, flush=True )
 
    # render as image
-   rndr.params.filepath = outdir + '/cluster.jpg'
-   rndr.source = ms.sink
-   rndr.run()
+   with timed( 'render' ):
+      rndr.params.filepath = outdir + '/cluster.jpg'
+      rndr.source = labels
+      rndr.run()
 
 # ---------------------------------------------------------------
 
@@ -148,14 +431,33 @@ def usage( self ):
         print( '       -h, --help', file=sys.stderr )
         print( '       -i datafile  --input=datafile', file=sys.stderr )
         print( '       -o outdir, --outdir=outdir',file=sys.stderr )
+        print( '       -d first:last, --days=first:last  (days [first,last) only)',
+               file=sys.stderr )
+        print( '       -w labelsfile, --warm=labelsfile  (warm start from a .labels file)',
+               file=sys.stderr )
+        print( '       -t rows, --tiles=rows  (out-of-core, in tiles of rows image rows)',
+               file=sys.stderr )
+        print( '       -s statefile, --state=statefile  (cluster a persistent histogram state)',
+               file=sys.stderr )
+        print( '       -a, --append  (add the days of datafile to the state first)',
+               file=sys.stderr )
+        print( '       -r, --remove  (remove the days of datafile from the state first)',
+               file=sys.stderr )
         
 def get_params( argv ):
+    global tile_rows
+
     datafile = None
     outdir = None
+    days = None
+    init = None
+    state = None
+    update = 0
         
     try:                                
-        opts, args = getopt.getopt( argv, 'hi:o:',
-                                    ['help','input=','outdir='] )
+        opts, args = getopt.getopt( argv, 'hi:o:d:w:t:s:ar',
+                                    ['help','input=','outdir=','days=','warm=','tiles=',
+                                     'state=','append','remove'] )
             
     except getopt.GetoptError:           
         self.usage()                          
@@ -169,24 +471,52 @@ def get_params( argv ):
             datafile = arg
         elif opt in ( '-o', '--outdir' ):
             outdir = arg
+        elif opt in ( '-d', '--days' ):
+            try:
+                first, last = arg.split( ':' )
+                days = ( int( first ), int( last ) )
+            except ValueError:
+                print( 'cluster_labels: bad day range:', arg, '...exiting' )
+                sys.exit(1)
+        elif opt in ( '-w', '--warm' ):
+            init = arg
+        elif opt in ( '-t', '--tiles' ):
+            tile_rows = int( arg )
+        elif opt in ( '-s', '--state' ):
+            state = arg
+        elif opt in ( '-a', '--append' ):
+            update = 1
+        elif opt in ( '-r', '--remove' ):
+            update = -1
         else:
             self.usage()                     
             sys.exit(1)
 
-    if datafile == None:
+    if update != 0 and state == None:
+        print( 'cluster_labels: --append and --remove need a state file...exiting' )
+        sys.exit(1)
+    if datafile == None and ( state == None or update != 0 ):
         print( 'cluster_labels: datafile is missing...exiting' )
         sys.exit(1)
-    if outdir == None:
+    if outdir == None and update == 0:
         print( 'cluster_labels: outdir is missing...exiting' )
         sys.exit(1)
 
-    return datafile, outdir
+    return datafile, outdir, days, init, state, update
 
 ####################################################################
 # command line user entry point 
 ####################################################################
 if __name__ == '__main__':  
 
-    dataf,outd = get_params( sys.argv[1:] )
-    print( dataf, outd )
-    cluster( dataf, outd )
+    dataf,outd,days,init,state,update = get_params( sys.argv[1:] )
+    print( dataf, outd, days )
+
+    if state == None:
+        cluster( dataf, outd, days, init )
+    else:
+        # eg. the yearly refresh: -s state.npz -a -i 2023_labels.npy -o outdir
+        if update != 0:
+            update_state( state, dataf, days, update )
+        if outd != None:
+            cluster_state( state, outd, init )
@@ -28,7 +28,9 @@ import os
 import sys
 #import getopt
 
-from npy_source_pack import npy_source
+# pipeline modules live one directory up
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from array_io import load_array
 
 # list pixels to sample (numpy arrays have origin at top left)
 # format used is x,y
@@ -46,18 +48,16 @@ outpath = dirpath + 'hist_points.csv'
 
 # ----------------------------------------------------------------
 
-# instantiate the numpy source operator
-src = npy_source.npy_source( 'npy_source' )
-src.params.filepath = inpath 
-
 # output file
 out = open( outpath, 'w' )
 out.write( inpath + '\n' ) # report numpy file
 
-src.run()   # read the numpy data
+# open the numpy data; .npy files are memory mapped so only
+# the sampled pixels are read
+hist = load_array( inpath )
 
 # get dimensions
-height,width,nbands = src.sink.shape
+height,width,nbands = hist.shape
 
 for i in range( len(pixels) ):
     x = pixels[i][0]
@@ -77,7 +77,7 @@ for i in range( len(pixels) ):
     out.write( str(x) +',' + str(y) + ',' )
 
     # retrieve the specified pixel's data
-    bands = src.sink[y,x,:] # numpy uses y,x format
+    bands = hist[y,x,:] # numpy uses y,x format
 
     # write out values 
     for j in range( nbands-1 ):
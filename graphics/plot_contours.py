@@ -19,25 +19,26 @@
 #  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 
+import os
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
-from npy_source_pack import npy_source
+# pipeline modules live one directory up
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+from array_io import load_array
 #from scale_pack import scale
 
 #dirpath = './2021/SOM_5x5_9_02_3_1/'
 dirpath = './2021/SOM_5x5_9_02_3_DIFF1/1-7/'
 nlabels = 12
 
-# numpy source
-src = npy_source.npy_source( 'npy_source' )        # instantiate
-src.params.filepath = dirpath + 'transcribed_cluster.npy'
+filepath = dirpath + 'transcribed_cluster.npy'
 
 # read the label image
-print( 'reading datafile: ' + src.params.filepath + '...',
+print( 'reading datafile: ' + filepath + '...',
        file=sys.stderr, flush=True, end='' )
-src.run()
+labels = load_array( filepath )
 print( 'done', file=sys.stderr, flush=True )
 
 '''
@@ -45,13 +46,13 @@ print( 'done', file=sys.stderr, flush=True )
 sc = scale.scale( 'scale' )                        # instantiate
 sc.params.sx = 6.0
 sc.params.sy = 6.0
-sc.source = src.sink
+sc.source = labels
 sc.run()
 
 # contour the scaled image
 image = sc.sink[:,:,0]
 '''
-image = src.sink[:,:,0]
+image = labels[:,:,0]
 
 # set up plot
 fig,ax = plt.subplots(1,1)
@@ -61,5 +62,5 @@ CS = ax.contour( image, levels, linewidths=.05, colors='black' )
 
 plt.ylim( 171, 0 ) # apparently vertically flips the image
 
-plt.title( 'Source file: ' + src.params.filepath )
+plt.title( 'Source file: ' + filepath )
 plt.show()
@@ -0,0 +1,452 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  label_hist.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+label_hist_copyright = 'label_hist.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# vectorized per-pixel label histograms for a (height,width,days) label cube.
+# produces the same bin counts as calling
+#
+#    np.histogram( cube[j,i,:], bins=nclasses, range=(0.0,float(nclasses-1)) )
+#
+# for every pixel, but in a few whole-array passes instead of a python loop.
+
+import os
+import sys
+import json
+import numpy as np
+
+index_days = 32                  # days binned per pass when making a cumulative index
+
+# ----------------------------------------------------------------------------
+
+# bin edges exactly as np.histogram makes them for this cube's dtype
+def bin_edges( dtype, nclasses ):
+
+    sample = np.zeros( (1), dtype=dtype )
+    return np.histogram_bin_edges( sample, bins=nclasses,
+                                   range=(0.0,float(nclasses-1)) )
+
+# map label values to bin indices, -1 for values outside the histogram range
+def bin_index( labels, nclasses, edges=None ):
+
+    if edges is None:
+        edges = bin_edges( labels.dtype, nclasses )
+
+    # small integer labels go through a lookup table, one pass
+    if labels.dtype == np.uint8:
+        table = bin_index( np.arange( 256, dtype=np.uint8 ).astype( edges.dtype ),
+                           nclasses, edges )
+        return table[ labels ]
+
+    # same rule as np.histogram: edges[k] <= x < edges[k+1],
+    # the last bin also includes the right edge
+    index = np.searchsorted( edges, labels, side='right' ) - 1
+    index[ labels == edges[-1] ] = nclasses - 1
+    index[ ~((labels >= edges[0]) & (labels <= edges[-1])) ] = -1
+
+    return index.astype( np.int16 )
+
+# histogram a block of rows; returns (rows,width,nclasses) int64 counts
+def band_histograms( band, nclasses, edges ):
+
+    rows, width, ndays = band.shape
+    npix = rows*width
+
+    index = bin_index( band, nclasses, edges ).reshape( npix, ndays )
+
+    # flat (pixel,bin) cell number for every in-range label
+    cells = np.arange( npix, dtype=np.int64 )[:,None]*nclasses + index
+    cells = cells[ index >= 0 ]
+
+    counts = np.bincount( cells, minlength=npix*nclasses )
+    return counts.reshape( rows, width, nclasses )
+
+# make the (height,width,nclasses) histogram cube of a (height,width,days) label cube.
+# if nrows is given, work in bands of nrows rows so that the temporaries
+# are bounded by the band size instead of the whole cube.
+def label_histograms( cube, nclasses, nrows=None, out=None ):
+
+    height, width, ndays = cube.shape
+
+    if out is None:
+        out = np.empty( (height,width,nclasses), dtype=np.int64 )
+
+    if nrows is None:
+        nrows = height
+
+    edges = bin_edges( cube.dtype, nclasses )
+
+    for j in range( 0, height, nrows ):
+        out[j:j+nrows] = band_histograms( cube[j:j+nrows], nclasses, edges )
+
+    return out
+
+# histograms of lut[labels] from the histograms of labels.
+# for integer labels in 0..nclasses-1 bin k counts label k, so transcribing
+# the labels through a LUT only moves column k to the bin of lut[k], summing
+# columns where the LUT is not one to one. the sums are int64: hist may be
+# stored compact (eg. uint8 for a year of days) and a summed column can
+# outgrow that type; save_array compacts it again.
+def remap_histograms( hist, lut, nclasses ):
+
+    lut = np.asarray( lut ).astype( np.uint8 )
+    target = bin_index( lut, nclasses )
+
+    out = np.zeros( hist.shape[:-1] + (nclasses,), dtype=np.int64 )
+    for k in range( len( lut ) ):
+        if target[k] >= 0:
+            out[...,target[k]] += hist[...,k]
+
+    return out
+
+# true if every label is an integer class 0..nclasses-1, the condition
+# under which remap_histograms matches histogramming transcribed labels
+# checked in bands of nrows rows so a memory mapped cube is streamed
+def integer_labels( cube, nclasses, nrows=64 ):
+
+    for j in range( 0, cube.shape[0], nrows ):
+        band = cube[j:j+nrows]
+
+        if band.dtype.kind in 'ui':
+            ok = int( band.max() ) < nclasses and int( band.min() ) >= 0
+        else:
+            ok = np.all( (band >= 0) & (band <= nclasses-1) & (band == np.floor( band )) )
+
+        if not ok:
+            return False
+
+    return True
+
+# ----------------------------------------------------------------------------
+
+# cumulative count index: cum[d,j,i,k] is the number of days before day d
+# that pixel (j,i) fell in bin k. the histogram of any [day_a,day_b) window
+# is then cum[day_b] - cum[day_a], with no rescan of the label cube.
+
+# index file kept next to the labels file, eg. 2019_labels_cumhist.npy
+def index_path( labelsfile ):
+
+    base, ext = os.path.splitext( labelsfile )
+    return base + '_cumhist.npy'
+
+# smallest unsigned type that holds a count of ndays
+def count_dtype( ndays ):
+
+    if ndays <= np.iinfo( np.uint16 ).max:
+        return np.uint16
+    return np.uint32
+
+# build the (days+1,height,width,nclasses) cumulative index of a label cube
+# and write it to path as a plain .npy file. if nrows is given, work in
+# tiles of nrows rows so that memory used does not grow with the grid
+def make_cumulative_index( cube, nclasses, path, nrows=None ):
+
+    height, width, ndays = cube.shape
+    if nrows is None:
+        nrows = height
+
+    # write under a temporary name so a killed run leaves no half index
+    tmppath = path + '.tmp'
+    cum = np.lib.format.open_memmap( tmppath, mode='w+', dtype=count_dtype( ndays ),
+                                     shape=(ndays+1,height,width,nclasses) )
+
+    edges = bin_edges( cube.dtype, nclasses )
+    cum[0] = 0
+
+    for j in range( 0, height, nrows ):
+        rows = min( nrows, height - j )
+        npix = rows*width
+        pixels = np.arange( npix )
+        running = np.zeros( (npix,nclasses), dtype=cum.dtype )
+
+        for d0 in range( 0, ndays, index_days ):
+            index = bin_index( cube[j:j+rows,:,d0:d0+index_days], nclasses, edges )
+            index = index.reshape( npix, -1 )
+
+            for k in range( index.shape[1] ):
+                valid = index[:,k] >= 0
+                running[ pixels[valid], index[valid,k] ] += 1
+                cum[d0+k+1,j:j+rows] = running.reshape( rows, width, nclasses )
+
+    cum.flush()
+    del cum
+    os.replace( tmppath, path )
+
+# open the cumulative index of a labels file, memory mapped.
+# returns None if there is no index or it is older than the labels file.
+def open_cumulative_index( labelsfile ):
+
+    path = index_path( labelsfile )
+    if not os.path.isfile( path ):
+        return None
+
+    if os.path.getmtime( path ) < os.path.getmtime( labelsfile ):
+        print( 'label_hist: index', path, 'is older than', labelsfile,
+               file=sys.stderr, flush=True )
+        return None
+
+    return np.load( path, mmap_mode='r' )
+
+# histograms of the days in [day_a,day_b) from a cumulative index
+def window_histograms( cum, day_a, day_b ):
+
+    ndays = cum.shape[0] - 1
+    if day_a < 0 or day_b > ndays or day_a >= day_b:
+        print( 'label_hist: day range', '%d:%d'%(day_a,day_b),
+               'is outside 0:%d...exiting'%ndays, file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    return cum[day_b].astype( np.int64 ) - cum[day_a]
+
+# ----------------------------------------------------------------------------
+
+# persistent histogram state: running per-pixel counts over a set of day
+# ranges of one or more labels files, so that a new season only needs its
+# own days histogrammed. the counts and the record of the day ranges they
+# hold are kept together in one .npz file, eg. state.npz (a state path
+# given as state.npy names the same file), so a crash cannot leave counts
+# that the ranges do not account for. ranges are stored per labels file
+# as [first,last) pairs. states written as a .npy and .json pair are
+# still read.
+
+def state_paths( path ):
+
+    base, ext = os.path.splitext( path )
+    return base + '.npz', base + '.npy', base + '.json'
+
+# open a histogram state; returns (counts,record) or (None,None) if there is none
+def read_hist_state( path ):
+
+    npzfile, npyfile, jsonfile = state_paths( path )
+
+    if os.path.isfile( npzfile ):
+        with np.load( npzfile ) as state:
+            return state['counts'], json.loads( str( state['record'] ) )
+
+    if not os.path.isfile( npyfile ) or not os.path.isfile( jsonfile ):
+        return None, None
+
+    with open( jsonfile, 'r' ) as jfile:
+        record = json.load( jfile )
+
+    return np.load( npyfile, mmap_mode='r' ), record
+
+# write counts and their record to one file under a temporary name, then
+# put it in place with a single rename
+def write_hist_state( path, counts, record ):
+
+    npzfile, npyfile, jsonfile = state_paths( path )
+
+    statedir = os.path.dirname( npzfile )
+    if statedir and not os.path.isdir( statedir ):
+        os.makedirs( statedir )
+
+    with open( npzfile + '.tmp', 'wb' ) as f:
+        np.savez( f, counts=counts.astype( count_dtype( record['ndays'] ) ),
+                  record=np.array( json.dumps( record ) ) )
+    os.replace( npzfile + '.tmp', npzfile )
+
+    # an older .npy and .json pair is superseded
+    for name in ( npyfile, jsonfile ):
+        if os.path.isfile( name ):
+            os.remove( name )
+
+# add (sign=1) or subtract (sign=-1) the histograms of days [day_a,day_b)
+# of labelsfile to the state at path, making the state if needed.
+# adding days already in the state or removing days not in it is refused.
+def update_hist_state( path, labelsfile, cube, nclasses, days=None, sign=1, nrows=64 ):
+
+    if days is None:
+        days = ( 0, cube.shape[2] )
+    day_a, day_b = days
+
+    if day_a < 0 or day_b > cube.shape[2] or day_a >= day_b:
+        print( 'label_hist: day range', '%d:%d'%(day_a,day_b),
+               'is outside 0:%d...exiting'%cube.shape[2], file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    counts, record = read_hist_state( path )
+    if record is None:
+        record = { 'nclasses': nclasses, 'shape': list( cube.shape[:2] ),
+                   'ndays': 0, 'ranges': {} }
+        counts = np.zeros( cube.shape[:2] + (nclasses,), dtype=np.int64 )
+
+    if record['nclasses'] != nclasses or tuple( record['shape'] ) != cube.shape[:2]:
+        print( 'label_hist: state', path, 'holds', record['shape'], 'pixels of',
+               record['nclasses'], 'classes, labels are', cube.shape[:2], '...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    name = os.path.abspath( labelsfile )
+    ranges = record['ranges'].get( name, [] )
+    if sign > 0:
+        ranges = add_range( ranges, day_a, day_b )
+    else:
+        ranges = remove_range( ranges, day_a, day_b )
+
+    if ranges is None:
+        print( 'label_hist: days %d:%d of'%(day_a,day_b), labelsfile,
+               'are already in the state' if sign > 0 else 'are not in the state',
+               path, '...exiting', file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    # only the days added or removed are histogrammed
+    hist = label_histograms( cube[:,:,day_a:day_b], nclasses, nrows )
+
+    counts = np.asarray( counts, dtype=np.int64 ) + sign*hist
+    record['ndays'] += sign*(day_b - day_a)
+    if ranges:
+        record['ranges'][name] = ranges
+    else:
+        record['ranges'].pop( name, None )
+
+    write_hist_state( path, counts, record )
+
+    return counts, record
+
+# merge [day_a,day_b) into a sorted list of [first,last) ranges;
+# None if it overlaps one of them
+def add_range( ranges, day_a, day_b ):
+
+    for first, last in ranges:
+        if day_a < last and first < day_b:
+            return None
+
+    merged = []
+    for first, last in sorted( ranges + [ [day_a,day_b] ] ):
+        if merged and merged[-1][1] == first:
+            merged[-1][1] = last
+        else:
+            merged.append( [first,last] )
+
+    return merged
+
+# cut [day_a,day_b) out of a list of ranges; None unless one range holds it all
+def remove_range( ranges, day_a, day_b ):
+
+    for k, ( first, last ) in enumerate( ranges ):
+        if first <= day_a and day_b <= last:
+            pieces = [ [first,day_a], [day_b,last] ]
+            return ranges[:k] + [ p for p in pieces if p[0] < p[1] ] + ranges[k+1:]
+
+    return None
+
+# original per-pixel loop, kept as reference for checking
+def loop_histograms( cube, nclasses ):
+
+    height, width, ndays = cube.shape
+    hist = np.empty( (height,width,nclasses), dtype=np.int64 )
+
+    for j in range( height ):
+        for i in range( width ):
+            h,b = np.histogram( cube[j,i,:], bins=nclasses,
+                                range=(0.0,float(nclasses-1)) )
+            hist[j,i,:] = h
+
+    return hist
+
+#------------------------------------------------
+if __name__ == '__main__':
+
+    # regression check: vectorized histograms must be bit-identical
+    # to the per-pixel loop for the label types we feed cluster()
+    nclasses = 25
+    rng = np.random.default_rng( 0 )
+
+    cube = rng.integers( 0, nclasses, (37,41,365) )
+    cubes = [ cube.astype( np.float32 ), cube.astype( np.uint8 ),
+              cube.astype( np.float64 ), cube.astype( np.int64 ) ]
+
+    # out of range and non integer values too
+    odd = rng.uniform( -2.0, nclasses+1.0, (11,13,50) ).astype( np.float32 )
+    odd[0,0,:5] = float( nclasses-1 )
+    odd[1,1,:3] = np.nan
+    cubes.append( odd )
+
+    failed = False
+    for c in cubes:
+        ref = loop_histograms( c, nclasses )
+        for nrows in [ None, 1, 7, 64 ]:
+            h = label_histograms( c, nclasses, nrows )
+            if h.dtype != ref.dtype or not np.array_equal( h, ref ):
+                print( 'label_hist: mismatch for dtype', c.dtype, 'nrows=', nrows,
+                       file=sys.stderr, flush=True )
+                failed = True
+
+    # remapped histograms match histograms of transcribed labels
+    lut = np.array( [ 0,2,1,4,9,5,6,7,13,13,10,11,12,8,14,20,15,17,18,19,21,16,22,23,24 ] )
+    c = cubes[0]
+    ref = label_histograms( lut[ c.astype( np.uint8 ) ].astype( np.float32 ), nclasses )
+    h = remap_histograms( label_histograms( c, nclasses ), lut, nclasses )
+    if not integer_labels( c, nclasses ) or not np.array_equal( h, ref ):
+        print( 'label_hist: remapped histograms do not match', file=sys.stderr, flush=True )
+        failed = True
+
+    # compact uint8 histograms whose merged columns pass 255 (8 and 9 go to 13)
+    c = np.zeros( (3,4,300), dtype=np.uint8 )
+    c[...,:150] = 8
+    c[...,150:] = 9
+    hist8 = label_histograms( c, nclasses ).astype( np.uint8 )
+    h = remap_histograms( hist8, lut, nclasses )
+    if h[...,13].min() != 300 or not np.all( h.sum( axis=-1 ) == 300 ):
+        print( 'label_hist: remapped uint8 histograms overflow', file=sys.stderr, flush=True )
+        failed = True
+
+    # window histograms from the cumulative index match a rescan
+    import tempfile
+    c = cubes[0]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = tmpdir + '/labels_cumhist.npy'
+        make_cumulative_index( c, nclasses, path, 5 )
+        cum = np.load( path, mmap_mode='r' )
+        make_cumulative_index( c, nclasses, tmpdir + '/whole_cumhist.npy' )
+        if not np.array_equal( cum, np.load( tmpdir + '/whole_cumhist.npy' ) ):
+            print( 'label_hist: tiled index differs from the whole grid index',
+                   file=sys.stderr, flush=True )
+            failed = True
+        for day_a, day_b in [ (0,365), (0,1), (31,59), (100,300), (364,365) ]:
+            h = window_histograms( cum, day_a, day_b )
+            ref = label_histograms( c[:,:,day_a:day_b], nclasses )
+            if h.dtype != ref.dtype or not np.array_equal( h, ref ):
+                print( 'label_hist: index mismatch for window', day_a, day_b,
+                       file=sys.stderr, flush=True )
+                failed = True
+        del cum
+
+    # a state built by appending and removing days matches a rescan
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = tmpdir + '/new/state.npy'
+        c = cubes[1]
+        update_hist_state( path, 'labels.npy', c, nclasses, (0,200) )
+        update_hist_state( path, 'labels.npy', c, nclasses, (200,365) )
+        update_hist_state( path, 'labels.npy', c, nclasses, (0,31), sign=-1 )
+        counts, record = read_hist_state( path )
+        ref = label_histograms( c[:,:,31:365], nclasses )
+        if ( not np.array_equal( counts, ref ) or record['ndays'] != 334 or
+             list( record['ranges'].values() ) != [ [[31,365]] ] ):
+            print( 'label_hist: histogram state does not match', file=sys.stderr, flush=True )
+            failed = True
+        del counts
+
+    if failed:
+        sys.exit( 1 )
+    print( 'label_hist: vectorized histograms match the per-pixel loop',
+           file=sys.stderr, flush=True )
@@ -0,0 +1,234 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  lut_store.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+lut_store_copyright = 'lut_store.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# all-pairs LUT store: one .npy file per LUT set instead of a directory of
+# per pair .lut text files. the store is a (nruns,nruns,nclass) uint8 array
+# indexed by run number, so store[a,b] is the LUT transcribing run a's
+# classes to run b's (the contents of a-b.lut). the diagonal holds the
+# identity LUT and missing entries are filled with the missing value.
+# a missing store[a,b] is derived as the inverse of store[b,a] when that
+# LUT is one to one.
+
+import os
+import sys
+import glob
+import getopt
+
+import numpy as np
+
+missing = 255                    # class value marking a LUT not in the store
+
+# ----------------------------------------------------------------------------
+
+# read a per pair .lut text file, eg. 0,2,1,4,...
+def read_lut_file( path ):
+
+    with open( path, 'r' ) as lfile:
+        line = lfile.readline()
+
+    return np.array( line.split( ',' ), dtype=np.int64 ).astype( np.uint8 )
+
+# write a LUT as a per pair .lut text file
+def write_lut_file( path, lut ):
+
+    with open( path, 'w' ) as lfile:
+        lfile.write( ','.join( str( int( v ) ) for v in lut ) + '\n' )
+
+# empty store for runs 0..nruns-1 with the identity LUT built in
+def make_store( nruns, nclass ):
+
+    store = np.full( (nruns,nruns,nclass), missing, dtype=np.uint8 )
+    store[ np.arange( nruns ), np.arange( nruns ) ] = np.arange( nclass, dtype=np.uint8 )
+
+    return store
+
+# build a store from a directory of a-b.lut files
+def convert_dir( lutdir, nclass=None ):
+
+    names = sorted( glob.glob( os.path.join( lutdir, '*-*.lut' ) ) )
+    if len( names ) == 0:
+        print( 'lut_store: no .lut files in', lutdir, '...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 1 )
+
+    luts = {}
+    for name in names:
+        tag1, tag2 = os.path.basename( name )[:-4].split( '-' )
+        luts[ (int( tag1 ),int( tag2 )) ] = read_lut_file( name )
+
+    if nclass is None:
+        nclass = len( next( iter( luts.values() ) ) )
+
+    nruns = max( max( pair ) for pair in luts ) + 1
+    store = make_store( nruns, nclass )
+
+    for (a,b), lut in luts.items():
+        if len( lut ) != nclass:
+            print( 'lut_store: LUT', '%02d-%02d'%(a,b), 'has', len( lut ),
+                   'classes, expected', nclass, '...exiting', file=sys.stderr, flush=True )
+            sys.exit( 1 )
+        store[a,b] = lut
+
+    return store
+
+# build a store by aligning every pair of .labels files in a directory
+def align_dir( labels_dir, metric=None, match=None ):
+
+    import show_diff
+
+    runs, luts = show_diff.compare_dir( labels_dir,
+                                        metric or show_diff.metric,
+                                        match or show_diff.match )
+
+    store = make_store( max( runs ) + 1, luts.shape[2] )
+    for a in range( len( runs ) ):
+        for b in range( len( runs ) ):
+            if a != b:
+                store[ runs[a], runs[b] ] = luts[a,b]
+
+    return store
+
+# write the a-b.lut files (a < b) of a store into a LUT directory
+def write_lut_dir( lutdir, store ):
+
+    if not os.path.isdir( lutdir ):
+        os.mkdir( lutdir )
+
+    nruns = store.shape[0]
+    for a in range( nruns ):
+        for b in range( a+1, nruns ):
+            if has_lut( store, a, b ):
+                write_lut_file( os.path.join( lutdir, '%02d-%02d.lut'%(a,b) ), store[a,b] )
+
+def write_store( path, store ):
+
+    np.save( path, store )
+
+# open a store memory mapped
+def open_store( path ):
+
+    return np.load( path, mmap_mode='r' )
+
+def has_lut( store, a, b ):
+
+    if a >= store.shape[0] or b >= store.shape[1]:
+        return False
+
+    return not np.all( store[a,b] == missing )
+
+# inverse of a one to one LUT
+def inverse_lut( lut ):
+
+    lut = np.asarray( lut )
+    if not np.array_equal( np.sort( lut ), np.arange( len( lut ) ) ):
+        print( 'lut_store: LUT', lut, 'is not one to one, it has no inverse...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    inverse = np.empty( len( lut ), dtype=np.uint8 )
+    inverse[ lut ] = np.arange( len( lut ) )
+
+    return inverse
+
+# the LUT transcribing run a's classes to run b's
+def get_lut( store, a, b ):
+
+    if has_lut( store, a, b ):
+        return np.array( store[a,b] )
+
+    if has_lut( store, b, a ):
+        return inverse_lut( store[b,a] )
+
+    print( 'lut_store: no LUT for runs', '%02d-%02d'%(a,b), '...exiting',
+           file=sys.stderr, flush=True )
+    sys.exit( 2 )
+
+# ----------------------------------------------------------------------------
+
+def usage():
+    print( 'usage: lut_store.py', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -l lutdir, --lutdir=lutdir  (directory of a-b.lut files)', file=sys.stderr )
+    print( '       -n labelsdir, --neurons=labelsdir  (align a directory of .labels files)',
+           file=sys.stderr )
+    print( '       -o store, --output=store    (eg. LUTs_2017-2021_first.npy)', file=sys.stderr )
+    print( '       -t lutdir, --text=lutdir    (also write a-b.lut files)', file=sys.stderr )
+    print( '       -m match, --match=match     (greedy or optimal)', file=sys.stderr )
+
+def get_params( argv ):
+
+    lutdir = None
+    labelsdir = None
+    output = None
+    textdir = None
+    match = None
+
+    try:
+        opts, args = getopt.getopt( argv, 'hl:n:o:t:m:',
+                                    ['help','lutdir=','neurons=','output=','text=','match='] )
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-l', '--lutdir' ):
+            lutdir = arg
+        elif opt in ( '-n', '--neurons' ):
+            labelsdir = arg
+        elif opt in ( '-o', '--output' ):
+            output = arg
+        elif opt in ( '-t', '--text' ):
+            textdir = arg
+        elif opt in ( '-m', '--match' ):
+            match = arg
+
+    if lutdir == None and labelsdir == None:
+        print( 'lut_store: lutdir or labelsdir is missing...exiting' )
+        sys.exit(1)
+
+    if output == None:
+        output = os.path.normpath( lutdir or labelsdir ) + '.npy'
+
+    return lutdir, labelsdir, output, textdir, match
+
+####################################################################
+# command line user entry point
+####################################################################
+if __name__ == '__main__':
+
+    lutd, labelsd, outp, textd, matchm = get_params( sys.argv[1:] )
+
+    if labelsd != None:
+        store = align_dir( labelsd, match=matchm )
+    else:
+        store = convert_dir( lutd )
+
+    write_store( outp, store )
+    if textd != None:
+        write_lut_dir( textd, store )
+    print( 'lut_store: wrote', outp, 'for runs 0 -', store.shape[0]-1,
+           file=sys.stderr, flush=True )
@@ -23,19 +23,46 @@
 
 import os
 import sys
+import json
 import math
+import queue
+import shutil
+import random
+import multiprocessing
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+
 from render_pack import render
 from show_diff import compare_files
-from npy_source_pack import npy_source
-from cluster_weather_labels import cluster
+from array_io import load_array, save_array, stored_name, array_file, transcribe_array
+from label_hist import label_histograms, remap_histograms, integer_labels
+from cluster_weather_labels import cluster, cluster_hist, som_params, hist_rows, ms
+import lut_store
+from agreement import agreement
+from stability import stability
+from stage_cache import stage_key, stage_done, clear_stage, mark_done
+import stage_timer
+from stage_timer import timed
 
 diff_out = './2019-GA/DIFF1/'
 lut_dir = './LUTs_2017-2021_5x5_4_00724_3_first/'
+lut_store_path = None      # binary LUT store (see lut_store.py); None uses lut_dir
 tally_name = diff_out + 'tally_diffs.txt'
+timing_name = diff_out + 'timing.jsonl'  # per stage timings; None for no log
 pcent_thresh = 4           # set to math.inf for no retries
 nfails = 2                 # number of threshold failures before continuing
+nworkers = 1               # pairs compared in parallel; 1 runs serially
+use_cache = True           # skip pair stages already done with the same inputs
+remap_hist = True          # remap each run's label histograms through the LUT
+                           # instead of transcribing and re-histogramming labels
+nseeds = 1                 # >1 trains this many SOMs with different seeds at once
+                           # instead of re-running serially on threshold failures
+seed_pick = 'first'        # 'first' seed under pcent_thresh, or 'best' of all
+seed_poll = 10.0           # seconds between looks for seed trials that died
+warm_start = False         # start pair clusterings from the second run's
+                           # cluster.labels with a short epoch schedule
+stability_dir = None       # write the ensemble stability map of all runs here
 
 # training instances to compare
 dirs = [ './2019-GA/SOM_5x5_4_00724_3_02/',
@@ -51,35 +78,41 @@ stdlut = np.empty( (nclass),dtype=np.uint8 )
 for i in range( nclass ):
     stdlut[i] = i
     
-# retrieve a LUT from file
+luts = None                # LUT store, opened once per process
+
+# retrieve a LUT from the LUT store or from file
 def get_lut( i, j ):
-    
+
+    global luts
+
+    # grab run number for both iterations
+    tag1 = dirs[i][-3:-1]
+    tag2 = dirs[j][-3:-1]
+
+    if lut_store_path != None:
+        if luts is None:
+            luts = lut_store.open_store( lut_store_path )
+        return lut_store.get_lut( luts, int( tag1 ), int( tag2 ) )
+
     if i == j :
         print( 'using the standard look-up table', file=sys.stderr, flush=True )
         lut = stdlut
     else:
-        # grab run number for both iterations
-        tag1 = dirs[i][-3:-1]
-        tag2 = dirs[j][-3:-1]
         lname = lut_dir + tag1 + '-' + tag2 + '.lut'
         
         # get look-up table from file:
         print( 'getting the look-up table from file:', lname,                               
                file=sys.stderr, flush=True )
         
-        lfile = open( lname, 'r' )
-        line = lfile.readline()
-        lfile.close()
-        
-        items = line.split( ',' )
-        lut = np.empty( (len( items )),dtype=np.uint8 )
-        
-        # load the look up table
-        for l in range( len(items) ):
-            lut[l] = int( items[l] )
+        lut = lut_store.read_lut_file( lname )
             
     return lut
 
+# weather labels file of a training instance
+def labels_file( i ):
+
+    return dirs[i] + '2019_labels.npy'  # TODO:change this for different trainings
+
 def check_dirs( dirs ):
     
     # check if input directories exist
@@ -100,83 +133,278 @@ def transcribe_weather( i, j, outdir ):
     lut = get_lut( i, j )
             
     # get first years data labels file and transcribe classes using lut
-    fname = dirs[i] + '2019_labels.npy'  # TODO:change this for different trainings
-    src1.params.filepath = fname
-    src1.run()
+    fname = labels_file( i )
+    labels = load_array( fname )
     
-    # input is float;  make byte for transcription
-    # then make back to float so clustering is done on same type
-    # (does it matter?, seems to)
+    # input is float; make byte for transcription and keep it byte.
+    # the label histograms clustered are the same for byte and float labels.
+    # streams band by band from and to memory mapped .npy files
     print( 'transcribing',fname,'... ',file=sys.stderr, flush=True, end='')
-    transcribed = lut[ src1.sink.astype( np.uint8 )].astype(np.float32)
+    transcribe_array( labels, lut, outdir + 'transcribed_labels.npy' )
+    print( 'done.', file=sys.stderr, flush=True )
+
+# file for the label histograms of a training instance, made once per sweep
+def run_hist_file( i ):
+
+    return diff_out + 'hist_' + dirs[i][-3:-1] + '.npy'
+
+def make_run_hist( i ):
+
+    fname = labels_file( i )
+    labels = load_array( fname )
+
+    # remapping histograms is only exact for integer class labels
+    if not integer_labels( labels, nclass ):
+        print( 'run_diff:', fname, 'has non class labels; set remap_hist = False...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 1 )
+
+    print( 'making histograms for',fname,'... ',file=sys.stderr, flush=True, end='')
+    save_array( run_hist_file( i ), label_histograms( labels, nclass, hist_rows ) )
+    print( 'done.', file=sys.stderr, flush=True )
+
+# make (or reuse) the label histograms of a training instance
+def run_hist( i ):
+
+    name = os.path.basename( run_hist_file( i ) )
+    key = stage_key( [ labels_file( i ) ], { 'nclass': nclass } )
+    stage_timer.set_context( run=dirs[i][-3:-1] )
+    run_stage( diff_out, name[:-4], key, [ stored_name( name ) ], make_run_hist, i )
+    stage_timer.set_context( run=None )
+
+def transcribe_hist( i, j, outdir ):
+
+    # the histograms of the first year's labels transcribed by the LUT
+    # are its own histograms with the class columns remapped
+    lut = get_lut( i, j )
+
+    print( 'transcribing histograms',run_hist_file( i ),'... ',
+           file=sys.stderr, flush=True, end='')
+    hist = remap_histograms( load_array( run_hist_file( i ) ), lut, nclass )
+    save_array( outdir + 'transcribed_hist.npy', hist )
     print( 'done.', file=sys.stderr, flush=True )
 
-    # save to file
-    tname = outdir + 'transcribed_labels.npy'
-    transcribed.dump( tname )
+# .labels file to warm start a pair's clustering from, or None
+def warm_file( j ):
+
+    if warm_start:
+        return dirs[j] + 'cluster.labels'
+
+    return None
+
+def cluster_transcribed( j, outdir ):
+
+    if remap_hist:
+        cluster_hist( load_array( outdir + 'transcribed_hist.npy' ), outdir, warm_file( j ) )
+    else:
+        cluster( outdir + 'transcribed_labels.npy', outdir, init=warm_file( j ) )
+
+# name of the copy of the second cluster image, .npy or .npz as stored
+def second_cluster_name( j ):
+
+    ext = os.path.splitext( array_file( dirs[j] + 'cluster.npy' ) )[1]
+    return 'second_cluster' + ext
+
+# put src at dst without copying its data: a hard link to the same file,
+# or a plain copy when linking fails (eg. another file system). staged
+# files are only ever read, so sharing them with the source is safe.
+# returns 'link' or 'copy'
+def stage_file( src, dst ):
+
+    if not os.path.isfile( src ):
+        print( 'run_diff: cannot stage', src, 'not found...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 1 )
+
+    if os.path.lexists( dst ):
+        os.remove( dst )
+
+    try:
+        os.link( src, dst )
+        return 'link'
+
+    except OSError:
+        pass
+
+    try:
+        shutil.copyfile( src, dst )
+        return 'copy'
+
+    except OSError as err:
+        print( 'run_diff: cannot stage', src, 'as', dst, ':', err, '...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 1 )
 
 def copy_files( i, j, outdir ):
     
-    # copy cluster renders to out directory
-    command =  'cp ' + dirs[i] + 'cluster.jpg ' + outdir + 'first_cluster.jpg' 
-    os.system( command )
-        
-    command =  'cp ' + dirs[j] + 'cluster.jpg ' + outdir + 'second_cluster.jpg' 
-    os.system( command )
-        
-    command =  'cp ' + dirs[j] + 'cluster.npy ' + outdir + 'second_cluster.npy' 
-    os.system( command )
+    # stage cluster renders and the second cluster image in the out directory
+    stage_file( dirs[i] + 'cluster.jpg', outdir + 'first_cluster.jpg' )
+    stage_file( dirs[j] + 'cluster.jpg', outdir + 'second_cluster.jpg' )
+    stage_file( array_file( dirs[j] + 'cluster.npy' ), outdir + second_cluster_name( j ) )
+
+# compare the clustering in outdir (or in trialdir, for a seed trial)
+# with the second training instance's clustering
+def transcribe_climate( i, j, outdir, trialdir=None ):
 
-def transcribe_climate( i, j, outdir ):
+    if trialdir is None:
+        trialdir = outdir
     
     # put the cluster render into a buffer
-    src1.params.filepath = outdir + 'cluster.npy'
-    src1.run()
+    first = load_array( trialdir + 'cluster.npy' )
 
     # get the clusters' SOMs
-    filepath1 = outdir + 'cluster.labels'
+    filepath1 = trialdir + 'cluster.labels'
     filepath2 = dirs[j] + 'cluster.labels'
 
     # read cluster labels files and make similarity (lut) map
     clut = compare_files( filepath1, filepath2 )
 
     # read the second cluster image
-    src2.params.filepath = outdir + 'second_cluster.npy'
-    src2.run()
+    second = load_array( outdir + second_cluster_name( j ) )
     
     # transcribe second cluster image using lut from compare_files
-    second = clut[ src2.sink ].astype( np.uint8 )
-    second.dump( outdir + 'transcribed_cluster.npy' )                                       
+    second = clut[ second ].astype( np.uint8 )
+    save_array( trialdir + 'transcribed_cluster.npy', second )
 
     # make a jpeg image of cluster
-    rndr.source = second
-    rndr.readlut( './luts/sixteenthbow.lut' )
-    rndr.params.filepath = outdir + 'transcribed_cluster.jpg'
-    rndr.run()
+    with timed( 'render' ):
+        rndr.source = second
+        rndr.readlut( './luts/sixteenthbow.lut' )
+        rndr.params.filepath = trialdir + 'transcribed_cluster.jpg'
+        rndr.run()
 
-    # take the difference between clusters
-    diff = src1.sink - second
-    mask = (diff != 0)             # mask is logical False, True
+    # score the agreement between clusters from their confusion matrix
+    with timed( 'diff' ):
+        score = agreement( first, second, nclass )
+        with open( trialdir + 'agreement.json', 'w' ) as afile:
+            json.dump( score, afile, indent=1 )
 
-    # highlight pixels in white that are different
-    out = np.zeros( src1.sink.shape, dtype=np.uint8 )
-    np.putmask( out, mask, 255 )
-    count = np.count_nonzero( out )
+    count = score['count']
+    pcent = score['pcent']
 
-    rndr.source = out
-    rndr.readlut( './luts/rainbow.lut' )
-    rndr.params.filepath = outdir + 'diff_pixels.jpg'  
-    rndr.run()
+    # highlight pixels in white that are different
+    with timed( 'render' ):
+        out = np.not_equal( first, second ).view( np.uint8 )
+        out *= 255
 
-    # number pixels = nx*ny
-    npix = src1.sink.shape[0]*src1.sink.shape[1]
-    pcent = (count/float(npix))*100
+        rndr.source = out
+        rndr.readlut( './luts/rainbow.lut' )
+        rndr.params.filepath = trialdir + 'diff_pixels.jpg'  
+        rndr.run()
 
     # report to terminal
     ostr = 'num of diff pixels=' + '%d,'%count + ' % diff=' + '%.2f'%pcent
+    ostr += ', ari=' + '%.4f'%score['ari'] + ', nmi=' + '%.4f'%score['nmi']
     print( ostr, file=sys.stderr, flush=True )        
 
-    return count, pcent
+    return count, pcent, score['ari'], score['nmi']
+
+# train and compare one seed's clustering in outdir/seed_<seed>/;
+# puts (seed,count,pcent,ari,nmi) on the results queue
+def seed_trial( i, j, outdir, seed, results ):
+
+    scores = ( -1, math.inf, math.nan, math.nan )
+    try:
+        make_operators()
+
+        trialdir = outdir + 'seed_%d/'%seed
+        if not os.path.isdir( trialdir ):
+            os.mkdir( trialdir )
+
+        ms.params.seed = seed
+        stage_timer.set_context( seed=seed )
+        cluster_hist( load_array( outdir + 'transcribed_hist.npy' ), trialdir, warm_file( j ) )
+        scores = transcribe_climate( i, j, outdir, trialdir )
+
+    finally:
+        results.put( (seed,) + tuple( scores ) )
+
+# train nseeds SOMs with different seeds on the same histograms at once,
+# keeping the first under pcent_thresh (or the best, for seed_pick 'best')
+# and stopping the rest. returns count, pcent, winning seed and the
+# number of trials finished when it was picked. a trial killed without
+# reporting (eg. by the OOM killer) counts as a failed attempt
+def speculate( i, j, outdir ):
+
+    # all seeds train on the same histogram image
+    if not remap_hist:
+        hist = label_histograms( load_array( outdir + 'transcribed_labels.npy' ),
+                                 nclass, hist_rows )
+        save_array( outdir + 'transcribed_hist.npy', hist )
+
+    base = ms.params.seed
+    if base is None:
+        base = random.SystemRandom().randrange( 2**31 - nseeds )
+    seeds = [ base + k for k in range( nseeds ) ]
+
+    results = multiprocessing.Queue()
+    trials = [ multiprocessing.Process( target=seed_trial,
+                                        args=( i, j, outdir, seed, results ) )
+               for seed in seeds ]
+    for trial in trials:
+        trial.start()
+
+    best = None
+    attempts = 0
+    reported = set()
+    while attempts < len( trials ):
+
+        # trials already dead before the wait have put their result, if any
+        dead = [ seed for seed, trial in zip( seeds, trials )
+                 if seed not in reported and not trial.is_alive() ]
+        try:
+            seed, count, pcent, ari, nmi = results.get( timeout=seed_poll )
+        except queue.Empty:
+            for seed in dead:
+                print( 'run_diff: seed trial', seed, 'died without a result',
+                       file=sys.stderr, flush=True )
+                reported.add( seed )
+                attempts += 1
+                if best is None:
+                    best = ( seed, -1, math.inf, math.nan, math.nan )
+            continue
+
+        reported.add( seed )
+        attempts += 1
+
+        if best is None or pcent < best[2]:
+            best = ( seed, count, pcent, ari, nmi )
+
+        if seed_pick == 'first' and pcent <= pcent_thresh:
+            break
+
+    # cancel the trials still training
+    for trial in trials:
+        if trial.is_alive():
+            trial.terminate()
+        trial.join()
+
+    seed, count, pcent, ari, nmi = best
+    if count < 0:
+        print( 'run_diff: no seed trial finished for', outdir, '...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 1 )
+
+    print( 'run_diff: seed', seed, 'picked after', attempts, 'trials, % diff=',
+           '%.2f'%pcent, file=sys.stderr, flush=True )
+    if pcent > pcent_thresh:
+        print( '###################################################',
+               file=sys.stderr, flush=True )
+        print( '# run_diff: no seed under pcent_thresh', pcent_thresh,
+               file=sys.stderr, flush=True )
+        print( '# keeping best seed', seed, 'with per cent error', '%.2f'%pcent,
+               file=sys.stderr, flush=True )
+        print( '###################################################',
+               file=sys.stderr, flush=True )
+
+    # the winner's outputs become the pair's
+    windir = outdir + 'seed_%d/'%seed
+    for name in os.listdir( windir ):
+        os.replace( windir + name, outdir + name )
+    for trial_seed in seeds:
+        shutil.rmtree( outdir + 'seed_%d/'%trial_seed, ignore_errors=True )
+
+    return count, pcent, ari, nmi, seed, attempts
 
 def print_fail( fail_count, pcent ):
     
@@ -207,56 +435,146 @@ def setup():
     if not os.path.isdir( diff_out ):
         os.mkdir( diff_out );          
 
-# -----------------------------------------------------------------------------
+# instantiate the operator used by this process.
+# each worker process makes its own; the clustering operators in
+# cluster_weather_labels are per process module copies.
+def make_operators():
 
-# main
+    global rndr
 
-# check input directories and make output directory
-setup()
+    rndr = render.render( 'render' )
+    stage_timer.set_log( timing_name )
 
-# instantiate operators
-rndr = render.render( 'render' )
-src1 = npy_source.npy_source( 'npy_source' )
-src2 = npy_source.npy_source( 'npy_source' )
+# stages of a pair comparison in the order they run
+pair_stages = [ 'copy', 'weather', 'cluster', 'climate', 'seeds', 'pair' ]
 
-# make difference tally out file
-tfile = open( tally_name, 'w' )
-tfile.write( 'dirs,num_diff_pixels,% diff\n' )
-tfile.flush()
+# run a stage of a pair comparison unless a run with the same key already
+# finished in outdir. returns the stage's result, from its stamp if skipped
+def run_stage( outdir, stage, key, outputs, func, *args ):
 
-fail_count = 0                    # keep track of threshold failures
+    if use_cache:
+        record = stage_done( outdir, stage, key )
+        if record is not None:
+            print( 'run_diff: skipping', stage, 'for', outdir, '(already done)',
+                   file=sys.stderr, flush=True )
+            with timed( stage, cached=True ):
+                return record['result']
 
-# compare ETo climate instances and calculate pixel differences
-for i in range( len( dirs) ):
+        # stages after this one used the old outputs, so redo them too
+        later = pair_stages[ pair_stages.index( stage ): ] if stage in pair_stages else [ stage ]
+        for name in later:
+            clear_stage( outdir, name )
 
-    j = i + 1     # target data index
+    with timed( stage ):
+        result = func( *args )
 
-    # use while loop n order to reset j counter in case of
-    # unusual pixel difference error.                                         
-    # python does not allow counter reset inside a loop   
-    while j < len( dirs ):
+    if use_cache:
+        mark_done( outdir, stage, key, outputs, result )
 
-        # grab run number for both iterations
-        tag1 = dirs[i][-3:-1]
-        tag2 = dirs[j][-3:-1]
+    return result
 
-        # create output directory
-        outdir = diff_out + tag1 + '-' + tag2 + '/'
-        if not os.path.isdir( outdir ):  
-            os.mkdir( outdir );          
+# all (i,j) pairs of training instances to compare, in tally order
+def get_pairs( ndirs ):
 
-        # copy files to output directory
-        copy_files( i, j, outdir )
+    return [ (i,j) for i in range( ndirs ) for j in range( i+1, ndirs ) ]
+
+def tally_row( tag1, tag2, count, pcent, ari, nmi, seed, attempts ):
+
+    return ( tag1 + '-' + tag2 + ',%d,'%count + '%.2f,'%pcent + str( seed ) +
+             ',%d'%attempts + ',%.4f,%.4f\n'%( ari, nmi ) )
+
+# compare one pair of ETo climate instances, timing the whole comparison
+def run_pair( pair ):
+
+    i, j = pair
+    stage_timer.set_context( pair=dirs[i][-3:-1] + '-' + dirs[j][-3:-1] )
+
+    try:
+        with timed( 'pair' ):
+            return compare_pair( pair )
+    finally:
+        stage_timer.set_context( pair=None, attempt=None )
+
+# compare one pair of ETo climate instances and calculate pixel differences.
+# returns the tally row for the pair
+def compare_pair( pair ):
+
+    i, j = pair
+
+    # grab run number for both iterations
+    tag1 = dirs[i][-3:-1]
+    tag2 = dirs[j][-3:-1]
+
+    # create output directory
+    outdir = diff_out + tag1 + '-' + tag2 + '/'
+    if not os.path.isdir( outdir ):  
+        os.mkdir( outdir );          
+
+    # stage keys; each chains in the key of the stage it depends on
+    copy_key = stage_key( [ dirs[i] + 'cluster.jpg', dirs[j] + 'cluster.jpg',
+                            array_file( dirs[j] + 'cluster.npy' ) ] )
+    weather_key = stage_key( [ labels_file( i ) ], { 'lut': get_lut( i, j ).tolist(),
+                                                     'remap': remap_hist } )
+    cluster_key = stage_key( [ warm_file( j ) ] if warm_start else [],
+                             { 'weather': weather_key, 'som': som_params() } )
+    climate_key = stage_key( [ dirs[j] + 'cluster.labels' ],
+                             { 'cluster': cluster_key, 'copy': copy_key,
+                               'scores': [ 'count', 'pcent', 'ari', 'nmi' ] } )
+    seeds_key = stage_key( params={ 'climate': climate_key, 'nseeds': nseeds,
+                                    'pick': seed_pick, 'thresh': pcent_thresh } )
+    pair_key = stage_key( params={ 'climate': climate_key, 'thresh': pcent_thresh,
+                                   'nfails': nfails } )
+
+    # a pair whose retries already finished keeps its outcome; its cached
+    # failing score must not count as a new failure and retrain it
+    if use_cache and nseeds <= 1:
+        record = stage_done( outdir, 'pair', pair_key )
+        if record is not None:
+            print( 'run_diff: skipping', outdir, '(already done)', file=sys.stderr, flush=True )
+            return record['result']['row']
+
+    fail_count = 0                    # keep track of threshold failures
+
+    # loop in order to re-run the comparison in case of
+    # unusual pixel difference error.                                         
+    while True:
+
+        stage_timer.set_context( attempt=fail_count+1 )
 
-        # transcribe first years ETo weather class values (xxxlabels.npy)
-        transcribe_weather( i, j, outdir )
+        # copy files to output directory
+        run_stage( outdir, 'copy', copy_key,
+                   [ 'first_cluster.jpg', 'second_cluster.jpg', second_cluster_name( j ) ],
+                   copy_files, i, j, outdir )
+
+        # transcribe first years ETo weather class values (xxxlabels.npy),
+        # or just their histograms
+        if remap_hist:
+            run_stage( outdir, 'weather', weather_key, [ stored_name( 'transcribed_hist.npy' ) ],
+                       transcribe_hist, i, j, outdir )
+        else:
+            run_stage( outdir, 'weather', weather_key, [ 'transcribed_labels.npy' ],
+                       transcribe_weather, i, j, outdir )
         
+        cluster_outputs = [ stored_name( 'hist.npy' ), stored_name( 'cluster.npy' ),
+                            'cluster.labels', 'cluster.jpg' ]
+        climate_outputs = [ stored_name( 'transcribed_cluster.npy' ),
+                            'transcribed_cluster.jpg', 'diff_pixels.jpg', 'agreement.json' ]
+
+        # train several seeds at once and keep one
+        if nseeds > 1:
+            count, pcent, ari, nmi, seed, attempts = run_stage( outdir, 'seeds', seeds_key,
+                                                                cluster_outputs + climate_outputs,
+                                                                speculate, i, j, outdir )
+            return tally_row( tag1, tag2, count, pcent, ari, nmi, seed, attempts )
+
         # cluster the transcribed data; renders ETo 'climate'
         # produces outdir/cluster.npy outdir/cluster.labels outdir/cluster.jpg
-        cluster( outdir + 'transcribed_labels.npy', outdir )
+        run_stage( outdir, 'cluster', cluster_key, cluster_outputs,
+                   cluster_transcribed, j, outdir )
 
         # now transcribe cluster SOM and take difference for ETo climate comparison
-        count, pcent = transcribe_climate( i, j, outdir )
+        count, pcent, ari, nmi = run_stage( outdir, 'climate', climate_key, climate_outputs,
+                                            transcribe_climate, i, j, outdir )
 
         # re-run comparison if greater than a given percent difference threshold
         if pcent > pcent_thresh:
@@ -265,17 +583,88 @@ for i in range( len( dirs) ):
             print_fail( fail_count, pcent )
 
             if fail_count < nfails:
-                continue        # go to while, do not drop down
+                # a re-run must train again, not reuse this clustering
+                clear_stage( outdir, 'cluster' )
+                continue        # re-run, do not drop down
             
-        # else report
-        tfile.write( tag1 + '-' + tag2 + ',%d,'%count + '%.2f\n'%pcent )
+        # else report; the last attempt only counted as a failure if it failed
+        attempts = fail_count + ( 1 if pcent <= pcent_thresh else 0 )
+        row = tally_row( tag1, tag2, count, pcent, ari, nmi, ms.params.seed, attempts )
+
+        if use_cache:
+            mark_done( outdir, 'pair', pair_key, cluster_outputs + climate_outputs,
+                       { 'row': row, 'fail_count': fail_count, 'attempts': attempts } )
+
+        return row
+
+# run the pair comparisons on nworkers processes and write the tally
+# rows in pair order, whatever order the workers finish in
+def run_pairs( pairs, tfile ):
+
+    if nworkers <= 1:
+        make_operators()
+        mapper = map
+    else:
+        pool = ProcessPoolExecutor( max_workers=nworkers,
+                                    initializer=make_operators )
+        mapper = pool.map
+
+    # label histograms of each training instance, shared by all its pairs
+    if remap_hist:
+        list( mapper( run_hist, range( len( dirs ) ) ) )
+
+    for row in mapper( run_pair, pairs ):
+        tfile.write( row )
         tfile.flush()
-        
-        j += 1
-        fail_count = 0
 
-    # end while j  
-# end for i
+    if nworkers > 1:
+        pool.shutdown()
+
+# modal class, agreement and entropy maps of all runs' clusterings,
+# aligned to the first run, with renders of the modal and agreement maps
+def ensemble_stability():
+
+    make_operators()
+    outdir = stability_dir.rstrip( '/' ) + '/'
+
+    with timed( 'stability' ):
+        stability( [ array_file( d + 'cluster.npy' ) for d in dirs ], outdir )
+
+        rndr.source = load_array( outdir + 'modal.npy' )
+        rndr.readlut( './luts/sixteenthbow.lut' )
+        rndr.params.filepath = outdir + 'modal.jpg'
+        rndr.run()
+
+        # agreement as grey levels, 255 where every run agrees
+        rndr.source = ( load_array( outdir + 'agreement.npy' )*255 ).astype( np.uint8 )
+        rndr.readlut( './luts/ramp.lut' )
+        rndr.params.filepath = outdir + 'agreement.jpg'
+        rndr.run()
+
+# -----------------------------------------------------------------------------
+
+# main
+if __name__ == '__main__':
+
+    # check input directories and make output directory
+    setup()
+
+    # make difference tally out file
+    tfile = open( tally_name, 'w' )
+    tfile.write( 'dirs,num_diff_pixels,% diff,seed,attempts,ari,nmi\n' )
+    tfile.flush()
+
+    # start a new timing log alongside the tally
+    if timing_name != None:
+        open( timing_name, 'w' ).close()
+
+    # compare ETo climate instances and calculate pixel differences
+    run_pairs( get_pairs( len( dirs ) ), tfile )
+
+    tfile.close()
+
+    # combined product of all runs
+    if stability_dir != None:
+        ensemble_stability()
 
-tfile.close()
-print( 'run_diff.py done', file=sys.stderr, flush=True )
+    print( 'run_diff.py done', file=sys.stderr, flush=True )
@@ -21,220 +21,286 @@
 
 # show the pixel difference between images
 
+import os
 import sys
+import glob
 import math
 import numpy as np
-import itertools
+
+from som_labels import read_labels
+from array_io import load_array
+from stage_timer import timed
+from agreement import confusion
 
 dirpath1 = './2019/SOM_5x5_6_01_3_1/'
 dirpath2 = './2020/SOM_5x5_6_01_3_1/'
 
+metric = 'euclidean'     # neuron distance: 'euclidean', 'manhattan' or 'cosine'
+match = 'greedy'         # label matching: 'greedy' or 'optimal'
+
 # ----------------------------------------------------------------------------
 
-# exhaustively run through LUT permutations for least pixel difference between clusters
-# impresivelly effective. however the brute force approach takes days
-# ie. for a lut of 12 elements it takes 12! (479,001,600) iterations
+# optimal assignment of rows to columns of a square cost matrix
+# (hungarian method, O(n^3)); returns assign with assign[row] = column
+# such that the sum of cost[row,assign[row]] is a minimum
+def min_cost_assignment( cost ):
+
+    cost = np.asarray( cost, dtype=np.float64 )
+    n = cost.shape[0]
+    if cost.shape != (n,n):
+        print( 'min_cost_assignment: cost matrix is not square...exiting.',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    # row and column potentials, index 0 is a dummy
+    u = np.zeros( (n+1) )
+    v = np.zeros( (n+1) )
+    p = np.zeros( (n+1), dtype=np.int64 )      # row matched to each column
+    way = np.zeros( (n+1), dtype=np.int64 )    # previous column on the path
+
+    for i in range( 1, n+1 ):
+
+        # grow an augmenting path for row i
+        p[0] = i
+        j0 = 0
+        minv = np.full( (n+1), math.inf )
+        used = np.zeros( (n+1), dtype=bool )
+
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+
+            free = ~used[1:]
+            cur = cost[i0-1,:] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+
+            cand = np.where( free, minv[1:], math.inf )
+            j1 = int( np.argmin( cand ) ) + 1
+            delta = cand[j1-1]
+
+            u[ p[used] ] += delta
+            v[ used ] -= delta
+            minv[1:][free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # flip the path
+        while j0 != 0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    assign = np.empty( (n), dtype=np.int64 )
+    assign[ p[1:]-1 ] = np.arange( n )
+
+    return assign
+
+# find the LUT with least pixel difference between clusters.
+# this used to run through every LUT permutation, which for a lut of
+# 12 elements took 12! (479,001,600) iterations, ie. days.
+# the pixel difference of a LUT is npix minus the pixels it keeps on the
+# diagonal of the confusion matrix, so the best LUT is the assignment of
+# second image labels to first image labels that keeps the most pixels.
 def compare_luts( imagepath1, imagepath2, nlabels ):
-    
+
     print( 'comparing images: ', imagepath1, 'and', imagepath2,
            file=sys.stderr, flush=True )
 
-    # first image
-    src1 = npy_source.npy_source( 'npy_source' )
-    src1.params.filepath = imagepath1
-    src1.run()
-
-    # second image
-    src2 = npy_source.npy_source( 'npy_source' )
-    src2.params.filepath = imagepath2
-    src2.run()
+    # first and second images
+    first = load_array( imagepath1 )
+    second = load_array( imagepath2 )
     
-    if src1.sink.shape != src2.sink.shape:
-        print( 'compaee_luts: image sizes do not match..exiting.',
+    if first.shape != second.shape:
+        print( 'compare_luts: image sizes do not match..exiting.',
                file=sys.stderr, flush=True )
         sys.exit( 2 )
 
-    # generate unique LUT values, ie. 0,1,2,3,...,N-1
-    invalues = [i for i in range(nlabels) ] # find unique permutations for this array
+    return match_labels( first, second, nlabels )
 
-    # test each LUT for minimum pixel difference
-    mindiff = math.inf
-    minlut = None
-    lut = None
-    i = 0
-    for l in itertools.permutations( invalues ):
+# minimum pixel difference LUT for transcribing labels2 into labels1 classes,
+# ie. the LUT minimizing count_nonzero( labels1 != lut[labels2] )
+def match_labels( labels1, labels2, nlabels ):
 
-        if i%100000 == 0:
-            print( 'i=', i, 'mindiff=', mindiff, 'lut:', minlut, 'last lut:', lut,
-                   file=sys.stderr, flush=True )
-            
-        # get the LUT permutation
-        lut = np.array( l )
-        
-        # transcribe labels from first run for comparison
-        second = lut[ src2.sink ].astype( np.uint8 )
-
-        # take the difference
-        diff = src1.sink - second
-        mask = (diff != 0)             # mask is logical False, True
-
-        # highlight pixels in white that are different
-        out = np.zeros( src1.sink.shape, dtype=np.uint8 )
-        np.putmask( out, mask, 255 )
-
-        count = np.count_nonzero( out )
-        if count < mindiff:
-            minlut = lut;
-            mindiff = count
-            
-        i +=1
-        
-    return minlut
+    conf = confusion( labels1, labels2, nlabels )
+
+    # row b (second label) to column a (first label), maximize kept pixels
+    lut = min_cost_assignment( -conf.T )
+
+    mindiff = conf.sum() - conf[ lut, np.arange( nlabels ) ].sum()
+    print( 'mindiff=', mindiff, 'lut:', lut, file=sys.stderr, flush=True )
+
+    return lut
+
+# distance matrix between two sets of neurons, arr[j,i] is the distance
+# from neurons1[j] to neurons2[i] for metric 'euclidean', 'manhattan' or 'cosine'.
+# leading dimensions broadcast, eg. (runs,1,n,d) against (1,runs,n,d)
+def distance_matrix( neurons1, neurons2, metric='euclidean' ):
+
+    neurons1 = np.asarray( neurons1, dtype=np.float64 )
+    neurons2 = np.asarray( neurons2, dtype=np.float64 )
 
-# use some metric to measure closeness
-def distance( neurons1, neurons2 ):
+    if metric == 'euclidean':
+        diff = neurons1[...,:,None,:] - neurons2[...,None,:,:]
+        return np.sqrt( np.sum( diff*diff, axis=-1 ) )
+
+    if metric == 'manhattan':
+        diff = neurons1[...,:,None,:] - neurons2[...,None,:,:]
+        return np.sum( np.abs( diff ), axis=-1 )
+
+    if metric == 'cosine':
+        norm1 = np.linalg.norm( neurons1, axis=-1 )
+        norm2 = np.linalg.norm( neurons2, axis=-1 )
+        dots = neurons1 @ np.swapaxes( neurons2, -1, -2 )
+        return 1.0 - dots/(norm1[...,:,None]*norm2[...,None,:])
+
+    print( 'distance_matrix: unknown metric:', metric, '...exiting.',
+           file=sys.stderr, flush=True )
+    sys.exit( 2 )
+
+# repeatedly take the closest pair of unmatched neurons.
+# ties go to the first pair in (j,i) order, as the original loops did
+def greedy_match( arr ):
+
+    arr = np.array( arr, dtype=np.float64 )
+    nlabels = arr.shape[0]
+
+    lut = np.empty( (nlabels), dtype=np.int64 )
+    for l in range( nlabels ):
+        j, i = divmod( int( np.argmin( arr ) ), nlabels )
+        lut[i] = j
+
+        # take both neurons out of the running
+        arr[j,:] = math.inf
+        arr[:,i] = math.inf
+
+    return lut
+
+# use some metric to measure closeness and match the labels of neurons2
+# to those of neurons1. match is 'greedy' (closest pairs first) or
+# 'optimal' (least total distance). returns lut with lut[i] = j
+def distance( neurons1, neurons2, metric=metric, match=match ):
 
     nlabels = len( neurons1 )
     if nlabels != len( neurons2 ):
         print( 'number of labels do not match ... exiting.',
                file=sys.stderr, flush=True )
+        sys.exit( 2 )
 
     ndims = len( neurons1[0] )
     if ndims != len( neurons2[0] ):
         print( 'number of neuron dimensions do not match ... exiting.',
                file=sys.stderr, flush=True )
-
-    # allocate array of all distance
-    arr = [ [0 for i in range( nlabels ) ] for j in range( nlabels ) ]
+        sys.exit( 2 )
 
     # array of vector distances
-    for j in range( nlabels ):
-        for i in range( nlabels ):
-            # euclidean
-            arr[j][i] = math.sqrt(sum(pow(a-b,2) for a, b in zip(neurons1[j],neurons2[i]) ) )
+    arr = distance_matrix( neurons1, neurons2, metric )
 
-            # manhattan
-            #arr[j][i] = sum(abs(a-b) for a,b in zip(neurons1[j], neurons2[i]) )
-            
     '''
     for j in range( nlabels ):
         for i  in range( nlabels ):
             print( '%5.1f '%arr[j][i], end='' )
         print( end='\n' )
     '''
-    
-    labelmap = []
 
-    for l in range( nlabels ):
-    
-        # find next minimum and unique indices
-        mindist = math.inf
-        for j in range( nlabels ):
-            for i in range( nlabels ):
-                found = False
-                for k in range( l ):
-                    if i == labelmap[k][0]:
-                        found = True
-                    if j == labelmap[k][1]:
-                        found = True
-                if not found and arr[j][i] < mindist:
-                    mindist = arr[j][i]
-                    ij = j
-                    ii = i
-
-        labelmap.append( [ ii, ij, mindist ] )
-
-    labelmap = sorted( labelmap )
-    
-    lut = np.empty( (nlabels), dtype=np.int8 )
-    for i  in range(nlabels ):
-        lut[i] = labelmap[i][1]
+    if match == 'greedy':
+        labelmap = greedy_match( arr )
+    elif match == 'optimal':
+        labelmap = min_cost_assignment( arr.T )
+    else:
+        print( 'distance: unknown match:', match, '...exiting.',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
 
-    return lut
+    return labelmap.astype( np.int8 )
 
-def get_label_header( labels ):
+# distance matrices between all runs of a (runs,neurons,dims) array,
+# arr[a,b] is distance_matrix( neurons[a], neurons[b] ).
+# made one run against all others at a time to bound memory
+def all_distance_matrices( neurons, metric=metric ):
 
-    # read header
-    found = False
-    for line in labels:
-        if line.find( 'NEURONS' ) != -1:
-            found = True
-            break
-        
-    if not found:
-        return None, None
+    nruns, nlabels, ndims = neurons.shape
+    arr = np.empty( (nruns,nruns,nlabels,nlabels) )
+
+    for a in range( nruns ):
+        arr[a] = distance_matrix( neurons[a][None], neurons, metric )
+
+    return arr
+
+# run number of a .labels file, eg. 2017-2021_5x5_4_00724_07.labels is run 7
+def run_number( filepath ):
+
+    base = os.path.splitext( os.path.basename( filepath ) )[0]
+    return int( base.split( '_' )[-1] )
+
+# align the neurons of every pair of .labels files in a directory.
+# returns the run numbers and luts[a,b], the LUT transcribing run a's
+# labels to run b's (as in a-b.lut), ie. distance( neurons[b], neurons[a] )
+def compare_dir( labels_dir, metric=metric, match=match ):
+
+    names = sorted( glob.glob( os.path.join( labels_dir, '*.labels' ) ) )
+    if len( names ) == 0:
+        print( 'compare_dir: no .labels files in', labels_dir, '...exiting.',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    print( 'reading', len( names ), 'labels files from', labels_dir,
+           file=sys.stderr, flush=True )
+
+    runs = [ run_number( name ) for name in names ]
+    neurons = np.array( [ read_neurons( name ) for name in names ] )
 
-    # read next line for number of labels (neurons) and dimensions
-    nlabels,ndims = labels.readline().split()
-    nlabels = int( nlabels )
-    ndims = int( ndims )
+    nruns, nlabels, ndims = neurons.shape
+    arr = all_distance_matrices( neurons, metric )
 
-    return nlabels, ndims
+    luts = np.empty( (nruns,nruns,nlabels), dtype=np.uint8 )
+    for a in range( nruns ):
+        for b in range( nruns ):
+            if match == 'greedy':
+                luts[a,b] = greedy_match( arr[b,a] )
+            else:
+                luts[a,b] = min_cost_assignment( arr[b,a].T )
 
+    return runs, luts
 
-def compare_files( filepath1, filepath2 ):
+# read the neuron weights of a .labels file as a (nlabels,ndims) array
+def read_neurons( filepath ):
+
+    neurons, header = read_labels( filepath )
+    return neurons
+
+def compare_files( filepath1, filepath2, metric=metric, match=match ):
     
     print( 'comparing files: ', filepath1, 'and', filepath2,
            file=sys.stderr, flush=True )
 
-    # first labels file
-    labels1 = open( filepath1, 'r' )
-    nlabels1, ndims1 = get_label_header( labels1 )
-    if nlabels1 == None:
-        print( 'could not find NEURONS flag in ', filepath1, ' exiting.',
-               file=sys.stderr, flush=True )
-        sys.exit( 2 )
+    with timed( 'compare_files' ):
 
-    # second file
-    labels2 = open( filepath2, 'r' )
-    nlabels2, ndims2 = get_label_header( labels2 )
-    if nlabels2 == None:
-        print( 'could not find NEURONS flag in ', filepath2, ' exiting.',
-               file=sys.stderr, flush=True )
-        sys.exit( 2 )
+        # read both labels files (or their cached parse)
+        neurons1, header1 = read_labels( filepath1 )
+        neurons2, header2 = read_labels( filepath2 )
 
-    if nlabels1 != nlabels2:
-        print( 'number of labels do not match...exiting',
-               file=sys.stderr, flush=True )
-        sys.exit( 2 )
+        if header1['nlabels'] != header2['nlabels']:
+            print( 'number of labels do not match...exiting',
+                   file=sys.stderr, flush=True )
+            sys.exit( 2 )
     
-    if ndims1 != ndims2:
-        print( 'number of dimensions do not match...exiting',
-               file=sys.stderr, flush=True )
-        sys.exit( 2 )
-        
-    print( 'reading vectors... ', file=sys.stderr, flush=True )
-
-    # actually 2D arrays
-    neurons1 = []
-    neurons2 = []
-
-    # populate arrays
-    for i in range( nlabels1 ):
-
-        # read and load the weights of first file
-        line1 = labels1.readline().split()
- 
-        # get the neuron weights (vector feature space)
-        neurons1.append([])
-        for j in range( 1, ndims1+1 ):       # skip grey level label
-            neurons1[i].append( float( line1[j] ) )
-     
-        # second file
-        line2 = labels2.readline().split()
-        neurons2.append([])
-        for j in range( 1, ndims2+1 ):       # skip grey level label
-            neurons2[i].append( float( line2[j] ) )
-   
-    # compare arrays
-
-    # get vector similarities
-    return distance( neurons1, neurons2 )
+        if header1['ndims'] != header2['ndims']:
+            print( 'number of dimensions do not match...exiting',
+                   file=sys.stderr, flush=True )
+            sys.exit( 2 )
+
+        # compare arrays
+
+        # get vector similarities
+        return distance( neurons1, neurons2, metric, match )
 
 #------------------------------------------------
 if __name__ == '__main__':
     
-    from npy_source_pack import npy_source
     from render_pack import render
 
     rndr = render.render( 'render' )
@@ -247,35 +313,29 @@ if __name__ == '__main__':
     lut = compare_files( filepath1, filepath2 )
     print( lut, file=sys.stderr, flush=True )
 
-    # use this for exhaustive approach
+    # use this for least pixel difference approach
     #lut = compare_luts( dirpath1 + 'cluster.npy', dirpath2 + 'cluster.npy', 12 )
     #print( lut, file=sys.stderr, flush=True )
     #sys.exit( 0 )
 
     # show the difference
     
-    # first source
-    src1 = npy_source.npy_source( 'npy_source' )
-    src1.params.filepath = dirpath1 + 'cluster.npy'
-
-    # second source
-    src2 = npy_source.npy_source( 'npy_source' )
-    src2.params.filepath = dirpath2 + 'cluster.npy'
-
     # read the first cluster image
-    print( 'reading first datafile: ' + src1.params.filepath + '...',
+    filepath1 = dirpath1 + 'cluster.npy'
+    print( 'reading first datafile: ' + filepath1 + '...',
            file=sys.stderr, flush=True, end='' )
-    src1.run()
+    first = load_array( filepath1 )
     print( 'done', file=sys.stderr, flush=True )
 
     # read the second cluster image
-    print( 'reading second datafile: ' + src2.params.filepath + '...',
+    filepath2 = dirpath2 + 'cluster.npy'
+    print( 'reading second datafile: ' + filepath2 + '...',
            file=sys.stderr, flush=True, end='' )
-    src2.run()
+    second = load_array( filepath2 )
     print( 'done', file=sys.stderr, flush=True )
 
     # transcribe labels from first run for comparison
-    second = lut[ src2.sink ].astype( np.uint8 )
+    second = lut[ second ].astype( np.uint8 )
 
     rndr.source = second
     rndr.readlut( '/home/agrineer/eto_study/scripts/luts/sixteenthbow.lut' )
@@ -283,17 +343,17 @@ if __name__ == '__main__':
     rndr.run()
 
     # take the difference
-    diff = src1.sink - second
+    diff = first - second
     mask = (diff != 0)             # mask is logical False, True
 
     # highlight pixels in white that are different
-    out = np.zeros( src1.sink.shape, dtype=np.uint8 )
+    out = np.zeros( first.shape, dtype=np.uint8 )
     np.putmask( out, mask, 255 )
 
     count = np.count_nonzero( out )
         
     # number pixels =  nx*ny
-    npix = src1.sink.shape[0]*src1.sink.shape[1]
+    npix = first.shape[0]*first.shape[1]
     pcent = (count/float(npix))*100
 
     # report to terminal
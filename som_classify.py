@@ -0,0 +1,86 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  som_classify.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+som_classify_copyright = 'som_classify.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# best matching unit (BMU) classification of pixels against trained neurons.
+# pixels are classified in fixed size blocks with the squared distance
+#
+#    ||x||^2 - 2 x.w + ||w||^2
+#
+# computed in float32 by one matrix product per block, so memory is bounded
+# by the block size and never holds a full (pixels x neurons) matrix.
+# ||x||^2 is the same for every neuron, so only -2 x.w + ||w||^2 is needed
+# to find the nearest neuron. this is msom's activation_distance
+# 'euclidean' only; maps trained with another distance must be applied
+# by msom itself.
+
+import sys
+import numpy as np
+
+block_pixels = 65536             # pixels classified per matrix product
+
+# ----------------------------------------------------------------------------
+
+# label each vector of data (...,nbands) with the label of its nearest neuron.
+# labels gives the label of each neuron (default its index). results are
+# written into out, a preallocated uint8 array with data.shape[:-1] elements
+# (eg. a (height,width,1) label image), or into a new one.
+def classify( data, neurons, labels=None, out=None, block=None ):
+
+    if block is None:
+        block = block_pixels
+
+    nbands = data.shape[-1]
+    vectors = data.reshape( -1, nbands )
+    npix = vectors.shape[0]
+
+    neurons = np.asarray( neurons, dtype=np.float32 )
+    if neurons.shape[1] != nbands:
+        print( 'classify: neurons have', neurons.shape[1], 'dimensions, data has',
+               nbands, '...exiting', file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    if labels is None:
+        labels = np.arange( len( neurons ) )
+    labels = np.asarray( labels ).astype( np.uint8 )
+
+    if out is None:
+        out = np.empty( data.shape[:-1], dtype=np.uint8 )
+    flat = out.reshape( -1 )                   # a view; out must be contiguous
+    if flat.size != npix:
+        print( 'classify: output has', flat.size, 'elements for', npix, 'pixels...exiting',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    wT = np.ascontiguousarray( neurons.T )
+    wsq = np.sum( neurons*neurons, axis=1 )
+
+    for k in range( 0, npix, block ):
+        x = np.asarray( vectors[k:k+block], dtype=np.float32 )
+
+        dist = x @ wT                          # (block,nneurons) BLAS product
+        dist *= -2.0
+        dist += wsq
+
+        flat[k:k+block] = labels[ np.argmin( dist, axis=1 ) ]
+
+    return out
@@ -0,0 +1,83 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  som_compress.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+som_compress_copyright = 'som_compress.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# weighted unique vector compression of SOM training data.
+# neighbouring pixels often have identical label histograms; training on
+# each distinct histogram once, drawn in proportion to how many pixels
+# share it, gives the SOM the same data distribution at a fraction of the
+# cost. labels found for the unique vectors are scattered back to pixels.
+
+import numpy as np
+
+# ----------------------------------------------------------------------------
+
+# round integer counts to the nearest multiple of quantum
+def quantize( vectors, quantum ):
+
+    return (vectors + quantum//2)//quantum*quantum
+
+# unique feature vectors of a (npix,nbands) array with their multiplicity.
+# returns uniq (nuniq,nbands), weights (nuniq) and inverse (npix) with
+# vectors[k] == uniq[inverse[k]]. quantum > 1 first rounds the vectors so
+# near identical ones collapse too
+def unique_vectors( vectors, quantum=None ):
+
+    vectors = np.asarray( vectors )
+    if quantum is not None and quantum > 1:
+        vectors = quantize( vectors, quantum )
+
+    uniq, inverse, weights = np.unique( vectors, axis=0,
+                                        return_inverse=True, return_counts=True )
+
+    return uniq, weights, inverse.reshape( -1 )
+
+# draw size training vectors from uniq with probability proportional to weight
+def weighted_sample( uniq, weights, size, seed=None ):
+
+    rng = np.random.default_rng( seed )
+    pick = rng.choice( len( uniq ), size=size, p=weights/weights.sum() )
+
+    return uniq[ pick ]
+
+# reservoir sampling (algorithm R) over vectors arriving in blocks. keeps a
+# uniform sample of everything seen in reservoir (size,nbands); nseen is
+# the number of vectors seen before this block. returns the new nseen
+def reservoir_update( reservoir, nseen, vectors, rng ):
+
+    size = len( reservoir )
+    vectors = vectors.reshape( -1, reservoir.shape[1] )
+
+    # the first vectors just fill the reservoir
+    nfill = max( 0, min( size - nseen, len( vectors ) ) )
+    reservoir[nseen:nseen+nfill] = vectors[:nfill]
+
+    # vector t (counting from 0) replaces a random slot with probability size/(t+1)
+    t = nseen + nfill + np.arange( len( vectors ) - nfill )
+    slot = rng.integers( 0, t + 1 )
+    keep = np.nonzero( slot < size )[0]
+
+    # when a slot is hit twice in one block the later vector wins
+    slots, last = np.unique( slot[keep][::-1], return_index=True )
+    reservoir[slots] = vectors[nfill:][ keep[::-1][last] ]
+
+    return nseen + len( vectors )
@@ -0,0 +1,158 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  som_labels.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+som_labels_copyright = 'som_labels.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# reader for msom .labels files (SOM map files):
+#
+#    timestamp=                2022-01-06T11:51:50.001052
+#    shape=                    (5, 5)
+#    ...
+#    quantization error=       0.34992862
+#    topographic error=        0.17932168
+#
+#    ############ NEURONS #############
+#     25 192
+#      0   0.140327   0.688364 ...
+#
+# returns the neuron weights and the header as a dict with typed values,
+# keys with blanks replaced by underscores (eg. header['quantization_error']).
+# parsed files are cached in a binary sidecar, eg. cluster.labels.npz,
+# which is used as long as the .labels file's size and mtime are unchanged.
+
+import os
+import sys
+import ast
+import json
+
+import numpy as np
+
+use_sidecar = True               # keep binary sidecar caches next to .labels files
+
+# files already read by this process, keyed on path, size and mtime
+parsed = {}
+
+# ----------------------------------------------------------------------------
+
+# header value as int, float, tuple, None, bool or else string
+def parse_value( text ):
+
+    try:
+        return ast.literal_eval( text )
+    except ( ValueError, SyntaxError ):
+        return text
+
+# parse the text of a .labels file
+def parse_labels( text, filepath ):
+
+    marker = text.find( 'NEURONS' )
+    if marker == -1:
+        print( 'could not find NEURONS flag in ', filepath, ' exiting.',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    header = {}
+    for line in text[:marker].splitlines():
+        if '=' not in line:
+            continue
+        name, value = line.split( '=', 1 )
+        header[ name.strip().replace( ' ', '_' ) ] = parse_value( value.strip() )
+
+    # line after the marker has the number of labels (neurons) and dimensions
+    body = text[ text.index( '\n', marker ) + 1: ].split( None, 2 )
+    nlabels = int( body[0] )
+    ndims = int( body[1] )
+
+    # bulk convert the table; first column is the grey level label
+    values = np.array( body[2].split()[ :nlabels*(ndims+1) ], dtype=np.float64 )
+    if values.size != nlabels*(ndims+1):
+        print( 'neuron table in', filepath, 'is short... exiting.',
+               file=sys.stderr, flush=True )
+        sys.exit( 2 )
+
+    table = values.reshape( nlabels, ndims+1 )
+
+    header['nlabels'] = nlabels
+    header['ndims'] = ndims
+    header['labels'] = table[:,0].astype( np.int64 )
+
+    return table[:,1:].copy(), header
+
+def sidecar_path( filepath ):
+
+    return filepath + '.npz'
+
+# neurons and header from a sidecar made for this version of the file
+def read_sidecar( filepath, st ):
+
+    try:
+        with np.load( sidecar_path( filepath ) ) as cache:
+            if ( int( cache['size'] ) != st.st_size or
+                 int( cache['mtime_ns'] ) != st.st_mtime_ns ):
+                return None
+
+            neurons = cache['neurons']
+            header = json.loads( str( cache['header'] ) )
+            header['labels'] = cache['labels']
+            if isinstance( header.get( 'shape' ), list ):
+                header['shape'] = tuple( header['shape'] )
+
+            return neurons, header
+
+    except ( OSError, KeyError, ValueError ):
+        return None
+
+def write_sidecar( filepath, st, neurons, header ):
+
+    fields = { k: v for k, v in header.items() if k != 'labels' }
+    tmppath = sidecar_path( filepath ) + '.tmp.npz'
+
+    try:
+        np.savez( tmppath, neurons=neurons, labels=header['labels'],
+                  header=json.dumps( fields, default=str ),
+                  size=st.st_size, mtime_ns=st.st_mtime_ns )
+        os.replace( tmppath, sidecar_path( filepath ) )
+
+    except OSError:
+        # read only directory, just go without a cache
+        pass
+
+# read a .labels file; returns (neurons,header) with neurons (nlabels,ndims)
+def read_labels( filepath ):
+
+    st = os.stat( filepath )
+    memo = ( os.path.abspath( filepath ), st.st_size, st.st_mtime_ns )
+    if memo in parsed:
+        return parsed[memo]
+
+    result = None
+    if use_sidecar:
+        result = read_sidecar( filepath, st )
+
+    if result is None:
+        with open( filepath, 'r' ) as labels:
+            result = parse_labels( labels.read(), filepath )
+
+        if use_sidecar:
+            write_sidecar( filepath, st, *result )
+
+    parsed[memo] = result
+    return result
@@ -0,0 +1,261 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  som_sweep.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+som_sweep_copyright = 'som_sweep.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# SOM hyperparameter sweep over a grid of msom settings, eg.
+#
+#    som_sweep.py -i 2019_labels.npy -o ./SWEEP/ -g sigma=2,2.5 -g rate=0.3,0.00724
+#    som_sweep.py -i 2019_labels.npy -o ./SWEEP/ -g "shape=(3,4),(5,5)"
+#
+# the label histograms are made once and put in shared memory; worker
+# processes train one SOM per grid point on that same histogram cube
+# without copying it. each trial writes its map to outdir/trial_NNN/ and
+# a row of sweep.csv: the settings, quantization and topographic error
+# (from the map's .labels header) and wall time.
+
+import os
+import sys
+import time
+import getopt
+import itertools
+
+import numpy as np
+
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cluster_weather_labels as cwl
+from label_hist import label_histograms
+from som_labels import read_labels as read_som_labels, parse_value
+
+nworkers = 4                     # trials trained at once
+
+# settings swept when none are given on the command line
+grid = { 'sigma':          [ 2, 2.5 ],
+         'rate':           [ 0.3, 0.00724 ],
+         'nepochs':        [ 4, 30 ],
+         'decay_function': [ 3, 4 ] }
+
+hist = None                      # a worker's view of the shared histograms
+shared = None                    # and the shared memory block behind it
+
+# ----------------------------------------------------------------------------
+
+# copy the histograms into a new shared memory block
+def share_hist( array ):
+
+    array = np.asarray( array, dtype=np.int64 )     # the training type, see cluster_hist
+    block = shared_memory.SharedMemory( create=True, size=max( 1, array.nbytes ) )
+
+    view = np.ndarray( array.shape, dtype=array.dtype, buffer=block.buf )
+    view[...] = array
+
+    return block
+
+# worker initializer: map the shared histograms, read only
+def attach_hist( name, shape, dtype ):
+
+    global hist, shared
+
+    shared = shared_memory.SharedMemory( name=name )
+    hist = np.ndarray( shape, dtype=dtype, buffer=shared.buf )
+    hist.flags.writeable = False
+
+# all combinations of the grid's settings, as a list of dicts
+def grid_points( grid ):
+
+    names = list( grid )
+    return [ dict( zip( names, values ) ) for values in itertools.product( *grid.values() ) ]
+
+# values of a -g option: split on the commas that are not inside
+# brackets, so tuples stay whole, eg. shape=(3,4),(5,5) or
+# topology=hexagonal,rectangular
+def grid_values( text ):
+
+    values = []
+    depth = 0
+    start = 0
+    for k, char in enumerate( text ):
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            values.append( text[start:k] )
+            start = k + 1
+    values.append( text[start:] )
+
+    return [ parse_value( v.strip() ) for v in values ]
+
+# train one SOM on the shared histograms with the settings in params.
+# returns the trial's row for the results table
+def run_trial( trial, params, outdir ):
+
+    trialdir = outdir + 'trial_%03d/'%trial
+    if not os.path.isdir( trialdir ):
+        os.mkdir( trialdir )
+
+    row = { 'trial': trial }
+    row.update( params )
+
+    t0 = time.perf_counter()
+    try:
+        ms = cwl.ms
+        for name, value in params.items():
+            setattr( ms.params, name, value )
+
+        # only the map is needed; QE and TE are in its header
+        ms.params.apply_classification = False
+        ms.params.mapfile_prefix = trialdir + 'cluster'
+        ms.source = hist
+        ms.run() # train
+
+        neurons, header = read_som_labels( ms.params.mapfile_prefix + '.labels' )
+        row['qe'] = header.get( 'quantization_error' )
+        row['te'] = header.get( 'topographic_error' )
+        row['error'] = ''
+
+    except Exception as err:
+        row['qe'] = row['te'] = None
+        row['error'] = repr( err )
+
+    row['wall'] = round( time.perf_counter() - t0, 3 )
+    return row
+
+def write_results( path, rows, names ):
+
+    columns = [ 'trial' ] + names + [ 'qe', 'te', 'wall', 'error' ]
+    with open( path, 'w' ) as rfile:
+        rfile.write( ','.join( columns ) + '\n' )
+        for row in sorted( rows, key=lambda r: r['trial'] ):
+            rfile.write( ','.join( '' if row[c] is None else str( row[c] ).replace( ',', ';' )
+                                   for c in columns ) + '\n' )
+
+# make the histograms of infile once and train a SOM for every grid point
+def sweep( infile, outdir, grid, days=None ):
+
+    if not outdir.endswith( '/' ):
+        outdir += '/'
+    if not os.path.isdir( outdir ):
+        os.makedirs( outdir )
+
+    if days is not None:
+        array = cwl.window_hist( infile, days )
+    else:
+        labels = cwl.read_labels( infile )
+        print( 'making histograms...', file=sys.stderr, flush=True, end='' )
+        array = label_histograms( labels, cwl.nclasses, cwl.hist_rows )
+    print( 'done', file=sys.stderr, flush=True )
+
+    points = grid_points( grid )
+    print( 'som_sweep:', len( points ), 'trials on', nworkers, 'workers',
+           file=sys.stderr, flush=True )
+
+    block = share_hist( array )
+    shape, dtype = array.shape, np.int64
+    del array
+
+    rows = []
+    try:
+        with ProcessPoolExecutor( max_workers=nworkers, initializer=attach_hist,
+                                  initargs=( block.name, shape, dtype ) ) as pool:
+            futures = [ pool.submit( run_trial, k, params, outdir )
+                        for k, params in enumerate( points ) ]
+
+            for future in as_completed( futures ):
+                row = future.result()
+                rows.append( row )
+                print( 'som_sweep: trial', row['trial'], 'qe=', row['qe'], 'te=', row['te'],
+                       'wall=', row['wall'], row['error'], file=sys.stderr, flush=True )
+
+                # keep the table current in case the sweep is stopped
+                write_results( outdir + 'sweep.csv', rows, list( grid ) )
+
+    finally:
+        block.close()
+        block.unlink()
+
+    return rows
+
+# ----------------------------------------------------------------------------
+
+def usage():
+    print( 'usage: som_sweep.py', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -i datafile  --input=datafile', file=sys.stderr )
+    print( '       -o outdir, --outdir=outdir', file=sys.stderr )
+    print( '       -d first:last, --days=first:last  (days [first,last) only)',
+           file=sys.stderr )
+    print( '       -g name=v1,v2,..., --grid=name=v1,v2,...  (msom setting to sweep, repeatable)',
+           file=sys.stderr )
+    print( '       -w nworkers, --workers=nworkers', file=sys.stderr )
+
+def get_params( argv ):
+
+    global nworkers
+
+    datafile = None
+    outdir = None
+    days = None
+    sweepgrid = {}
+
+    try:
+        opts, args = getopt.getopt( argv, 'hi:o:d:g:w:',
+                                    ['help','input=','outdir=','days=','grid=','workers='] )
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-i', '--input' ):
+            datafile = arg
+        elif opt in ( '-o', '--outdir' ):
+            outdir = arg
+        elif opt in ( '-d', '--days' ):
+            first, last = arg.split( ':' )
+            days = ( int( first ), int( last ) )
+        elif opt in ( '-g', '--grid' ):
+            name, values = arg.split( '=', 1 )
+            sweepgrid[ name ] = grid_values( values )
+        elif opt in ( '-w', '--workers' ):
+            nworkers = int( arg )
+
+    if datafile == None:
+        print( 'som_sweep: datafile is missing...exiting' )
+        sys.exit(1)
+    if outdir == None:
+        print( 'som_sweep: outdir is missing...exiting' )
+        sys.exit(1)
+
+    return datafile, outdir, days, sweepgrid or grid
+
+####################################################################
+# command line user entry point
+####################################################################
+if __name__ == '__main__':
+
+    dataf, outd, days, sweepgrid = get_params( sys.argv[1:] )
+    sweep( dataf, outd, sweepgrid, days )
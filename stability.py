@@ -0,0 +1,185 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  stability.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+stability_copyright = 'stability.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# ensemble stability of the cluster maps of several training runs.
+# the maps are aligned to the first one (each through the LUT that
+# minimizes its pixel difference with it, or through given LUTs) and
+# streamed in row bands; per pixel the class votes of all runs give
+#
+#    modal.npy          (height,width,1) uint8 most frequent class
+#    agreement.npy      (height,width,1) float32 fraction of runs voting for it
+#    entropy.npy        (height,width,1) float32 entropy of the votes in bits
+#    disagreement.csv   run by run % of pixels labelled differently
+#
+# memory is a band of votes, (band pixels,nclass), plus the run by run
+# counts, whatever the number of pairs.
+
+import os
+import sys
+import glob
+import getopt
+
+import numpy as np
+
+from array_io import load_array, create_array
+from agreement import confusion
+from show_diff import min_cost_assignment
+
+nclass = 25                      # climate classes
+band_rows = 64                   # image rows per pass
+
+# ----------------------------------------------------------------------------
+
+# LUTs putting each map's classes into the first map's, found from the
+# maps' confusion matrices. the matrices are counted in chunks, so
+# aligning memory mapped maps does not read a whole map in at once
+def align_maps( maps, nclass ):
+
+    luts = [ np.arange( nclass, dtype=np.uint8 ) ]
+    for m in maps[1:]:
+        conf = confusion( maps[0], m, nclass )
+
+        # row b (map label) to column a (first map label), maximize kept pixels
+        luts.append( min_cost_assignment( -conf.T ).astype( np.uint8 ) )
+
+    return luts
+
+# stability products of the cluster map files in paths, written to outdir.
+# luts[r] transcribes map r into the common classes; None aligns the maps
+# to the first. returns the run by run disagreement (%) matrix
+def stability( paths, outdir, luts=None ):
+
+    maps = [ load_array( path ) for path in paths ]
+    nruns = len( maps )
+    shape = maps[0].shape
+    for path, m in zip( paths, maps ):
+        if m.shape != shape:
+            print( 'stability:', path, 'is', m.shape, 'not', shape, '...exiting',
+                   file=sys.stderr, flush=True )
+            sys.exit( 2 )
+
+    if luts is None:
+        print( 'stability: aligning', nruns, 'maps...', file=sys.stderr, flush=True, end='' )
+        luts = align_maps( maps, nclass )
+        print( 'done', file=sys.stderr, flush=True )
+    luts = [ np.asarray( lut ).astype( np.uint8 ) for lut in luts ]
+
+    if not os.path.isdir( outdir ):
+        os.makedirs( outdir )
+
+    height, width = shape[:2]
+    modal = create_array( outdir + '/modal.npy', (height,width,1), np.uint8 )
+    agree = create_array( outdir + '/agreement.npy', (height,width,1), np.float32 )
+    entropy = create_array( outdir + '/entropy.npy', (height,width,1), np.float32 )
+    differ = np.zeros( (nruns,nruns), dtype=np.int64 )
+
+    print( 'stability: voting in bands of', band_rows, 'rows...',
+           file=sys.stderr, flush=True, end='' )
+    for j in range( 0, height, band_rows ):
+        bands = [ lut[ np.asarray( m[j:j+band_rows] ).reshape( -1 ) ] for m, lut in zip( maps, luts ) ]
+        npix = bands[0].size
+        cells = np.arange( npix, dtype=np.int64 )*nclass
+
+        votes = np.zeros( npix*nclass, dtype=np.int64 )
+        for band in bands:
+            votes += np.bincount( cells + band, minlength=npix*nclass )
+        votes = votes.reshape( npix, nclass )
+
+        rows = slice( j, j + npix//width )
+        modal[rows] = np.argmax( votes, axis=1 ).reshape( -1, width, 1 )
+        agree[rows] = ( votes.max( axis=1 )/nruns ).reshape( -1, width, 1 )
+
+        p = votes/nruns
+        logp = np.log2( p, out=np.zeros_like( p ), where=p > 0 )
+        entropy[rows] = ( -np.sum( p*logp, axis=1 ) ).reshape( -1, width, 1 )
+
+        for a in range( nruns ):
+            for b in range( a+1, nruns ):
+                differ[a,b] += np.count_nonzero( bands[a] != bands[b] )
+    print( 'done', file=sys.stderr, flush=True )
+
+    for array in ( modal, agree, entropy ):
+        array.flush()
+
+    differ = differ + differ.T
+    pcent = 100.0*differ/(height*width)
+    write_disagreement( outdir + '/disagreement.csv', paths, pcent )
+
+    return pcent
+
+# run by run % disagreement as csv, rows and columns named by map file
+def write_disagreement( path, paths, pcent ):
+
+    names = [ os.path.relpath( p ) for p in paths ]
+    with open( path, 'w' ) as dfile:
+        dfile.write( 'map,' + ','.join( names ) + '\n' )
+        for name, row in zip( names, pcent ):
+            dfile.write( name + ',' + ','.join( '%.2f'%v for v in row ) + '\n' )
+
+# ----------------------------------------------------------------------------
+
+def usage():
+    print( 'usage: stability.py [options] cluster.npy ...', file=sys.stderr )
+    print( '       -h, --help', file=sys.stderr )
+    print( '       -o outdir, --outdir=outdir', file=sys.stderr )
+    print( '       -g pattern, --glob=pattern  (eg. "./2019-GA/SOM_*/cluster.npy")',
+           file=sys.stderr )
+
+def get_params( argv ):
+
+    outdir = None
+    paths = []
+
+    try:
+        opts, args = getopt.getopt( argv, 'ho:g:', ['help','outdir=','glob='] )
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ( '-h', '--help' ):
+            usage()
+            sys.exit(0)
+        elif opt in ( '-o', '--outdir' ):
+            outdir = arg
+        elif opt in ( '-g', '--glob' ):
+            paths += sorted( glob.glob( arg ) )
+
+    paths += args
+    if len( paths ) < 2:
+        print( 'stability: need at least two cluster maps...exiting' )
+        sys.exit(1)
+    if outdir == None:
+        print( 'stability: outdir is missing...exiting' )
+        sys.exit(1)
+
+    return paths, outdir
+
+#------------------------------------------------
+if __name__ == '__main__':
+
+    paths, outd = get_params( sys.argv[1:] )
+    pcent = stability( paths, outd )
+    print( 'stability: mean run by run disagreement %.2f%%'%
+           ( pcent.sum()/max( 1, len( paths )*(len( paths )-1) ) ), file=sys.stderr, flush=True )
@@ -0,0 +1,119 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  stage_cache.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+stage_cache_copyright = 'stage_cache.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# content addressed stage cache for resuming sweeps.
+# a stage's key is a hash of its input files' contents and its parameters.
+# when a stage finishes, a stamp file recording the key and the sizes of
+# its outputs is written into the output directory. a later run with the
+# same key skips the stage if all outputs are still there; a missing stamp
+# or a changed output means the stage was interrupted and is redone.
+
+import os
+import sys
+import json
+import hashlib
+
+block_size = 1 << 20             # bytes read per block when hashing files
+
+# file hashes already computed by this process, keyed on path, size and mtime
+hashes = {}
+
+# ----------------------------------------------------------------------------
+
+# sha1 of a file's contents
+def file_hash( path ):
+
+    st = os.stat( path )
+    memo = ( os.path.abspath( path ), st.st_size, st.st_mtime_ns )
+    if memo in hashes:
+        return hashes[memo]
+
+    h = hashlib.sha1()
+    with open( path, 'rb' ) as f:
+        while True:
+            block = f.read( block_size )
+            if not block:
+                break
+            h.update( block )
+
+    hashes[memo] = h.hexdigest()
+    return hashes[memo]
+
+# key for a stage from its input files and parameters.
+# parameters must be json serializable; other stages' keys can be
+# passed as parameters to chain stages together.
+def stage_key( files=[], params={} ):
+
+    record = { 'files': [ file_hash( f ) for f in files ],
+               'params': params }
+
+    text = json.dumps( record, sort_keys=True, default=str )
+    return hashlib.sha1( text.encode() ).hexdigest()
+
+def stamp_path( outdir, stage ):
+
+    return os.path.join( outdir, '.' + stage + '.stamp' )
+
+# the stamp record of a finished stage if its key matches and all its
+# outputs are complete, otherwise None
+def stage_done( outdir, stage, key ):
+
+    try:
+        with open( stamp_path( outdir, stage ), 'r' ) as f:
+            record = json.load( f )
+    except ( OSError, ValueError ):
+        return None
+
+    if record.get( 'key' ) != key:
+        return None
+
+    for name, size in record['outputs'].items():
+        path = os.path.join( outdir, name )
+        if not os.path.isfile( path ) or os.path.getsize( path ) != size:
+            print( 'stage_cache:', stage, 'output', path, 'is incomplete',
+                   file=sys.stderr, flush=True )
+            return None
+
+    return record
+
+# remove a stage's stamp; done before the stage (re)writes its outputs
+def clear_stage( outdir, stage ):
+
+    try:
+        os.remove( stamp_path( outdir, stage ) )
+    except FileNotFoundError:
+        pass
+
+# record a finished stage with its outputs and any result values
+def mark_done( outdir, stage, key, outputs, result=None ):
+
+    record = { 'key': key,
+               'outputs': { name: os.path.getsize( os.path.join( outdir, name ) )
+                            for name in outputs },
+               'result': result }
+
+    # write then rename so a stamp is never half written
+    path = stamp_path( outdir, stage )
+    with open( path + '.tmp', 'w' ) as f:
+        json.dump( record, f )
+    os.replace( path + '.tmp', path )
@@ -0,0 +1,167 @@
+#! /usr/bin/env /usr/bin/python3
+
+#  stage_timer.py
+#
+#  Copyright (C) 2020-2023 Scott L. Williams.
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+stage_timer_copyright = 'stage_timer.py Copyright (c) 2020-2023 Scott L. Williams, released under GNU GPL V3.0'
+
+# per stage wall time, cpu time and peak memory, written as one JSON line
+# per stage to a log file (eg. timing.jsonl next to tally_diffs.txt):
+#
+#    {"stage": "cluster", "pair": "02-03", "wall": 41.2, "cpu": 40.8,
+#     "maxrss_mb": 812.4, "children_maxrss_mb": 0.0, "pid": 4711,
+#     "time": "2023-01-09T19:12:44"}
+#
+# each record costs a few clock reads and a look at /proc, so timing can
+# stay on for production sweeps. maxrss_mb is the peak resident size of
+# the process during the stage: the kernel's high water mark (VmHWM) is
+# reset when a stage starts, so a stage is not charged for an earlier,
+# bigger one. where it cannot be reset (not linux) the record says
+# "rss_scope": "process" and maxrss_mb is the peak since the process
+# started. children_maxrss_mb is the biggest waited for child so far.
+# lines are appended with a single write, so worker processes can share
+# the log.
+
+import os
+import sys
+import json
+import time
+import resource
+
+from contextlib import contextmanager
+
+enabled = True                   # record stage timings
+log_path = None                  # JSON lines file; None keeps records in memory
+
+context = {}                     # fields added to every record, eg. the pair
+records = []                     # records made by this process while log_path is None
+
+peaks = []                       # peak rss (KB) so far of the stages being timed, innermost last
+
+# ----------------------------------------------------------------------------
+
+def set_log( path ):
+
+    global log_path
+    log_path = path
+
+# set (or with None, drop) fields added to every record
+def set_context( **fields ):
+
+    for name, value in fields.items():
+        if value is None:
+            context.pop( name, None )
+        else:
+            context[name] = value
+
+# reset the process' high water mark; False where that is not possible
+def reset_peak():
+
+    try:
+        with open( '/proc/self/clear_refs', 'w' ) as refs:
+            refs.write( '5' )
+        return True
+    except OSError:
+        return False
+
+# high water mark of the resident size in KB, since the last reset.
+# falls back to the peak since the process started (ru_maxrss is in KB
+# on linux)
+def peak_rss_kb():
+
+    try:
+        with open( '/proc/self/status', 'r' ) as status:
+            for line in status:
+                if line.startswith( 'VmHWM:' ):
+                    return int( line.split()[1] )
+    except ( OSError, ValueError ):
+        pass
+
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+# start the peak of a stage. the reset would lose the peak of the stages
+# it is nested in, so it is kept for them first
+def begin_peak():
+
+    if peaks:
+        peaks[-1] = max( peaks[-1], peak_rss_kb() )
+    peaks.append( 0 )
+
+    return reset_peak()
+
+# end the peak of a stage; returns it in MB
+def end_peak():
+
+    peak = max( peaks.pop(), peak_rss_kb() )
+    if peaks:
+        peaks[-1] = max( peaks[-1], peak )
+
+    return peak/1024.0
+
+# peak resident size of the biggest waited for child in MB
+def children_rss_mb():
+
+    return resource.getrusage( resource.RUSAGE_CHILDREN ).ru_maxrss/1024.0
+
+def write_record( record ):
+
+    # a long running process (eg. cluster_service) logs to a file; only
+    # keep records in memory when there is none
+    if log_path is None:
+        records.append( record )
+        return
+
+    try:
+        with open( log_path, 'a' ) as log:
+            log.write( json.dumps( record, default=str ) + '\n' )
+    except OSError as err:
+        print( 'stage_timer: cannot write', log_path, err, file=sys.stderr, flush=True )
+
+# time the body of a with statement as stage; extra fields go in the record
+@contextmanager
+def timed( stage, **fields ):
+
+    if not enabled:
+        yield
+        return
+
+    reset = begin_peak()
+    wall0 = time.perf_counter()
+    cpu0 = time.process_time()
+    try:
+        yield
+    finally:
+        record = { 'stage': stage }
+        record.update( context )
+        record.update( fields )
+        record['wall'] = round( time.perf_counter() - wall0, 4 )
+        record['cpu'] = round( time.process_time() - cpu0, 4 )
+        record['maxrss_mb'] = round( end_peak(), 1 )
+        record['children_maxrss_mb'] = round( children_rss_mb(), 1 )
+        if not reset:
+            record['rss_scope'] = 'process'
+        record['pid'] = os.getpid()
+        record['time'] = time.strftime( '%Y-%m-%dT%H:%M:%S' )
+        write_record( record )
+
+# read a timing log back as a list of records
+def read_log( path ):
+
+    with open( path, 'r' ) as log:
+        return [ json.loads( line ) for line in log if line.strip() ]